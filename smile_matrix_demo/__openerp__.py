@@ -38,6 +38,7 @@
         'smile_period_view.xml',
         'smile_profile_view.xml',
         'smile_employee_view.xml',
+        'smile_matrix_demo_cron.xml',
     ],
     "installable": True,
     "active": False,
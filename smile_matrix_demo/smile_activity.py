@@ -19,12 +19,11 @@
 #
 ##############################################################################
 
-import datetime
 import random
 import os
 
 from osv import osv, fields
-from smile_matrix_field.matrix_field import matrix, matrix_read_patch, matrix_write_patch, LINE_RENDERING_MODES
+from smile_matrix_field.matrix_field import matrix, matrix_read_patch, matrix_write_patch, matrix_vacuum, matrix_remove_duplicate_cells, LINE_RENDERING_MODES
 
 
 
@@ -50,6 +49,7 @@ class smile_activity_report(osv.osv):
     _columns = {
         'name': fields.char('Name', size=32),
         'period_id': fields.many2one('smile.activity.period', "Period", required=True),
+        'employee_id': fields.many2one('smile.activity.employee', "Employee"),
         'start_date': fields.related('period_id', 'start_date', type='date', string="Start date", readonly=True),
         'end_date': fields.related('period_id', 'end_date', type='date', string="End date", readonly=True),
         'line_ids': fields.one2many('smile.activity.report.line', 'report_id', "Activity lines"),
@@ -127,6 +127,13 @@ class smile_activity_report(osv.osv):
         }
 
 
+    ## Constraints
+
+    _sql_constraints = [
+        ('period_employee_unique', 'unique(period_id, employee_id)', "An employee can't have two reports for the same period."),
+        ]
+
+
     ## Native methods
 
     def create(self, cr, uid, vals, context=None):
@@ -148,6 +155,14 @@ class smile_activity_report(osv.osv):
     def write(self, cr, uid, ids, vals, context=None):
         return super(smile_activity_report, self).write(cr, uid, ids, vals, context)
 
+
+    ## Custom methods
+
+    def vacuum_matrix_cells(self, cr, uid, ids=None, context=None):
+        """ Remove stale cells of the matrix. This method is called by a scheduled action.
+        """
+        return matrix_vacuum(self, cr, uid, ids, context)
+
 smile_activity_report()
 
 
@@ -194,7 +209,7 @@ class smile_activity_report_line(osv.osv):
 
     def create(self, cr, uid, vals, context=None):
         line_id = super(smile_activity_report_line, self).create(cr, uid, vals, context)
-        # Create default cells
+        # Create default cells, except the ones provided with the line, like the cells submitted by the matrix
         line = self.browse(cr, uid, line_id, context)
         self.generate_cells(cr, uid, line, context)
         return line_id
@@ -203,13 +218,16 @@ class smile_activity_report_line(osv.osv):
     ## Custom methods
 
     def generate_cells(self, cr, uid, line, context=None):
-        """ This method generate all cells between the date range.
+        """ This method generate all cells between the date range, skipping dates the line already has a cell for.
         """
+        existing_dates = set([str(cell.date) for cell in line.cell_ids])
         period_lines = line.report_id.period_id.visible_line_ids
         vals = {
             'line_id': line.id
             }
         for period_line in period_lines:
+            if str(period_line.date) in existing_dates:
+                continue
             vals.update({'date': period_line.date})
             self.pool.get('smile.activity.report.cell').create(cr, uid, vals, context)
         return
@@ -292,26 +310,32 @@ class smile_activity_report_cell(osv.osv):
         return True
 
     def _check_date(self, cr, uid, ids, context=None):
-        for cell in self.browse(cr, uid, ids,context):
-            date = datetime.datetime.strptime(cell.date, '%Y-%m-%d')
-            report = cell.line_id.report_id
-            start_date = datetime.datetime.strptime(report.start_date, '%Y-%m-%d')
-            end_date = datetime.datetime.strptime(report.end_date, '%Y-%m-%d')
-            if date < start_date or date > end_date:
-                return False
-        return True
-
-    def _check_duplicate(self, cr, uid, ids, context=None):
-        for cell in self.browse(cr, uid, ids, context):
-            if len(self.search(cr, uid, [('date', '=', cell.date), ('line_id', '=', cell.line_id.id)], context=context)) > 1:
-                return False
-        return True
+        """ Check with a single query that cells are within the date range of their report
+        """
+        if not ids:
+            return True
+        cr.execute("""SELECT c.id FROM smile_activity_report_cell c
+            JOIN smile_activity_report_line l ON l.id = c.line_id
+            JOIN smile_activity_report r ON r.id = l.report_id
+            JOIN smile_activity_period p ON p.id = r.period_id
+            WHERE c.id IN %s AND (c.date < p.start_date OR c.date > p.end_date)
+            LIMIT 1""", (tuple(ids), ))
+        return not cr.fetchone()
 
     _constraints = [
         #(_check_quantity, "Quantity can't be negative.", ['quantity']),
-        (_check_duplicate, "Two cells can't share the same date.", ['date']),
         # Constraint below is not required as the matrix code will remove out of range cells
         #(_check_date, "Cell date is out of the activity report date range.", ['date']),
         ]
 
+    _sql_constraints = [
+        ('line_date_unique', 'unique(line_id, date)', "Two cells can't share the same date."),
+        ]
+
+    def _auto_init(self, cr, context=None):
+        """ Remove duplicate cells first, else the unique constraint can't be added to the table
+        """
+        matrix_remove_duplicate_cells(self, cr, 'line_id', 'date')
+        return super(smile_activity_report_cell, self)._auto_init(cr, context)
+
 smile_activity_report_cell()
@@ -20,6 +20,7 @@
 ##############################################################################
 
 from osv import osv, fields
+from smile_matrix_field.matrix_field import matrix_resource_patch
 
 
 
@@ -31,4 +32,19 @@ class smile_activity_employee(osv.osv):
         'profile_id': fields.many2one('smile.activity.profile', "Default profile", required=True),
         }
 
+
+    ## Native methods
+
+    @matrix_resource_patch
+    def create(self, cr, uid, vals, context=None):
+        return super(smile_activity_employee, self).create(cr, uid, vals, context)
+
+    @matrix_resource_patch
+    def write(self, cr, uid, ids, vals, context=None):
+        return super(smile_activity_employee, self).write(cr, uid, ids, vals, context)
+
+    @matrix_resource_patch
+    def unlink(self, cr, uid, ids, context=None):
+        return super(smile_activity_employee, self).unlink(cr, uid, ids, context)
+
 smile_activity_employee()
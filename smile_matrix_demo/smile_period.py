@@ -20,10 +20,58 @@
 ##############################################################################
 
 import datetime
+import logging
 from dateutil.relativedelta import relativedelta
+from multiprocessing.dummy import Pool
 
+import pooler
 from osv import osv, fields
 from tools.translate import _
+from smile_matrix_field.date_range import get_date_range, get_record_date_range
+from smile_matrix_field.matrix_stamp import get_stamps, touch_stamps
+
+
+
+_logger = logging.getLogger('smile_matrix_demo')
+
+
+
+def _get_line_stamp_name(period_id):
+    """ Return the name of the stamp incremented each time lines of the period change
+    """
+    return 'smile.activity.period.line,%d' % period_id
+
+
+
+def _rollover_chunk(args):
+    """ Provision in a single transaction the reports of a chunk of employees, with their default lines and cells.
+        Each call runs on its own cursor, so chunks are committed independently of each other.
+    """
+    dbname, uid, period_id, employee_ids, project_ids = args
+    cr = pooler.get_db(dbname).cursor()
+    try:
+        # Employees already provisioned by a previous run are skipped
+        cr.execute("""INSERT INTO smile_activity_report (period_id, employee_id, name, create_uid, create_date, write_uid, write_date)
+            SELECT %s, e.id, substr(e.name, 1, 32), %s, now(), %s, now() FROM smile_activity_employee e
+            WHERE e.id IN %s
+            AND NOT EXISTS (SELECT 1 FROM smile_activity_report r WHERE r.period_id = %s AND r.employee_id = e.id)
+            RETURNING id""", (period_id, uid, uid, tuple(employee_ids), period_id))
+        report_ids = [row[0] for row in cr.fetchall()]
+        if report_ids and project_ids:
+            cr.execute("""INSERT INTO smile_activity_report_line (report_id, project_id, create_uid, create_date, write_uid, write_date)
+                SELECT r.id, p.id, %s, now(), %s, now() FROM smile_activity_report r, smile_activity_project p
+                WHERE r.id IN %s AND p.id IN %s""", (uid, uid, tuple(report_ids), tuple(project_ids)))
+            cr.execute("""INSERT INTO smile_activity_report_cell (line_id, date, quantity, active, read_only, create_uid, create_date, write_uid, write_date)
+                SELECT l.id, pl.date, 0.0, true, false, %s, now(), %s, now() FROM smile_activity_report_line l
+                JOIN smile_activity_period_line pl ON pl.period_id = %s AND pl.visible_day = true
+                WHERE l.report_id IN %s""", (uid, uid, period_id, tuple(report_ids)))
+        cr.commit()
+    except Exception:
+        cr.rollback()
+        raise
+    finally:
+        cr.close()
+    return len(employee_ids)
 
 
 
@@ -89,26 +137,32 @@ class smile_activity_period(osv.osv):
         return res
 
     def _get_day_range(self, cr, uid, ids, name, arg, context=None):
-        """ Get a list of date objects covering the given date range
+        """ Get the range of days covered by the periods
         """
         result = {}
-        for period in self.browse(cr, uid, ids, context):
-            day_range = []
-            start_date = self._str_to_date(period.start_date)
-            end_date = self._str_to_date(period.end_date)
-            date = start_date
-            while date <= end_date:
-                day_range.append(date)
-                date = date + datetime.timedelta(days=1)
-            result[period.id] = day_range
+        for period in self.read(cr, uid, ids, ['start_date', 'end_date'], context, load='_classic_write'):
+            result[period['id']] = get_date_range(self._str_to_date(period['start_date']), self._str_to_date(period['end_date']))
         return result
 
     def _get_visible_day_range(self, cr, uid, ids, name, arg, context=None):
-        """ Get a list of visible date objects covering the given date range
+        """ Get the range of visible days of the periods.
+            Ranges are cached against the committed stamp of period lines, so lines are only fetched again after they were created, updated or removed.
         """
         res = {}
-        for period in self.browse(cr, uid, ids, context):
-            res[period.id] = [self._str_to_date(l.date) for l in period.visible_line_ids]
+        day_ranges = self._get_day_range(cr, uid, ids, name, arg, context)
+        stamps = get_stamps(cr, [_get_line_stamp_name(period_id) for period_id in ids])
+        for period_id in ids:
+            day_range = day_ranges[period_id]
+            def compute_visible_range():
+                cr.execute("SELECT date FROM smile_activity_period_line WHERE period_id = %s AND visible_day = true", (period_id, ))
+                visible_dates = set([self._str_to_date(row[0]) for row in cr.fetchall()])
+                return get_date_range(day_range.start, day_range.end, exclusions=[d for d in day_range if d not in visible_dates])
+            stamp = stamps[_get_line_stamp_name(period_id)]
+            if stamp is None:
+                # Lines were changed by the current transaction, don't cache ranges computed from them
+                res[period_id] = compute_visible_range()
+            else:
+                res[period_id] = get_record_date_range(cr.dbname, self._name, period_id, (day_range, stamp), compute_visible_range)
         return res
 
 
@@ -126,6 +180,8 @@ class smile_activity_period(osv.osv):
         'date_range': fields.function(_get_day_range, string="Day range", type='selection', readonly=True, method=True),
         # The visible_date_range is a matrix widget convention
         'visible_date_range': fields.function(_get_visible_day_range, string="Visible day range", type='selection', readonly=True, method=True),
+        # Employee reports are created in the background by a scheduled action
+        'rollover_requested': fields.boolean("Employee reports requested", readonly=True),
         }
 
     _defaults = {
@@ -215,32 +271,91 @@ class smile_activity_period(osv.osv):
 
     def update_date_range(self, cr, uid, ids, context):
         """ Create and remove period lines to keep the date range in sync start date and stop date
+            Lines of all periods are synchronized together, with one query to remove out of range lines and another one to create missing lines.
         """
         if isinstance(ids, (int, long)):
             ids = [ids]
-        for period in self.browse(cr, uid, ids, context):
-            start_date = self._str_to_date(period.start_date)
-            end_date = self._str_to_date(period.end_date)
-            # Remove out of range lines
-            outdated_lines = []
-            for line in period.line_ids:
-                date = self._str_to_date(period.end_date)
-                if date < start_date or date > end_date:
-                    outdated_lines.append(line.id)
-            if outdated_lines:
-                self.pool.get('smile.activity.period.line').unlink(cr, uid, outdated_lines, context)
-            # Create missing lines to cover the whole period
-            exiting_line_dates = [self._str_to_date(l.date) for l in period.line_ids]
-            for date in [self._str_to_date(d) for d in period.date_range]:
-                # Skip saturdays and sundays
-                if date not in exiting_line_dates and date.weekday() not in [5, 6]:
-                    vals = {
-                        'date': date,
-                        'period_id': period.id,
-                        }
-                    self.pool.get('smile.activity.period.line').create(cr, uid, vals, context)
+        if not ids:
+            return
+        # Remove out of range lines
+        cr.execute("""SELECT l.id FROM smile_activity_period_line l
+            JOIN smile_activity_period p ON p.id = l.period_id
+            WHERE l.period_id IN %s AND (l.date < p.start_date OR l.date > p.end_date)""", (tuple(ids), ))
+        outdated_lines = [row[0] for row in cr.fetchall()]
+        if outdated_lines:
+            self.pool.get('smile.activity.period.line').unlink(cr, uid, outdated_lines, context)
+        # Create missing lines to cover the whole period, skipping saturdays and sundays
+        cr.execute("""INSERT INTO smile_activity_period_line (period_id, date, visible_day, create_uid, create_date, write_uid, write_date)
+            SELECT days.period_id, days.date, true, %s, now(), %s, now() FROM (
+                SELECT id AS period_id, (start_date + generate_series(0, end_date - start_date))::date AS date
+                FROM smile_activity_period WHERE id IN %s
+                ) AS days
+            WHERE extract(dow FROM days.date) NOT IN (0, 6)
+            AND NOT EXISTS (SELECT 1 FROM smile_activity_period_line l WHERE l.period_id = days.period_id AND l.date = days.date)""", (uid, uid, tuple(ids)))
+        touch_stamps(cr, [_get_line_stamp_name(period_id) for period_id in ids])
         return
 
+    def request_rollover(self, cr, uid, ids, context=None):
+        """ Flag the periods for the scheduled action to create their employee reports, as it may take a long time
+        """
+        return self.write(cr, uid, ids, {'rollover_requested': True}, context)
+
+    def run_rollover_scheduler(self, cr, uid, context=None):
+        """ Create the employee reports of requested periods. This method is called by a scheduled action.
+        """
+        period_ids = self.search(cr, uid, [('rollover_requested', '=', True)], context=context)
+        for period_id in period_ids:
+            self.rollover(cr, uid, [period_id], context)
+            self.write(cr, uid, [period_id], {'rollover_requested': False}, context)
+            cr.commit()
+        return True
+
+    def _check_committed(self, cr, ids):
+        """ Raise an error if the given periods or their lines have changes not committed yet, as other cursors can't see them
+        """
+        if None in get_stamps(cr, [_get_line_stamp_name(period_id) for period_id in ids]).values():
+            raise osv.except_osv('Error !', "Period lines must be saved before employee reports are created.")
+        check_cr = pooler.get_db(cr.dbname).cursor()
+        try:
+            check_cr.execute("SELECT id FROM smile_activity_period WHERE id IN %s", (tuple(ids), ))
+            missing_ids = set(ids).difference([row[0] for row in check_cr.fetchall()])
+        finally:
+            check_cr.close()
+        if missing_ids:
+            raise osv.except_osv('Error !', "Periods %s must be saved before employee reports are created." % ', '.join(map(str, sorted(missing_ids))))
+
+    def rollover(self, cr, uid, ids, context=None, workers=4, chunk_size=200):
+        """ Provision the reports of all employees for the given periods, with their default lines and cells.
+            Employees are processed by chunks, in parallel, each chunk being committed on its own. The job can be restarted at will: employees already having a report for the period are skipped.
+            Chunks run on their own cursors, so periods and their lines must be committed first. Call it from run_rollover_scheduler() or a script, not from the user interface.
+        """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids:
+            return True
+        self._check_committed(cr, ids)
+        project_ids = self.pool.get('smile.activity.project').search(cr, uid, [('add_by_default', '=', True)], context=context)
+        for period_id in ids:
+            cr.execute("""SELECT e.id FROM smile_activity_employee e
+                WHERE NOT EXISTS (SELECT 1 FROM smile_activity_report r WHERE r.period_id = %s AND r.employee_id = e.id)
+                ORDER BY e.id""", (period_id, ))
+            employee_ids = [row[0] for row in cr.fetchall()]
+            if not employee_ids:
+                _logger.info("Period %d rollover: all employees already have a report." % period_id)
+                continue
+            chunks = [(cr.dbname, uid, period_id, employee_ids[i:i + chunk_size], project_ids) for i in range(0, len(employee_ids), chunk_size)]
+            # Workers are threads and not processes: forked processes would share the database connections of the server
+            pool = Pool(min(workers, len(chunks)))
+            try:
+                done = 0
+                for chunk_len in pool.imap_unordered(_rollover_chunk, chunks):
+                    done += chunk_len
+                    _logger.info("Period %d rollover: %d/%d employees processed." % (period_id, done, len(employee_ids)))
+            finally:
+                pool.close()
+                pool.join()
+        return True
+
 smile_activity_period()
 
 
@@ -264,6 +379,38 @@ class smile_activity_period_line(osv.osv):
         }
 
 
+    ## Native methods
+
+    def create(self, cr, uid, vals, context=None):
+        line_id = super(smile_activity_period_line, self).create(cr, uid, vals, context)
+        self._touch_periods(cr, uid, [line_id], context)
+        return line_id
+
+    def write(self, cr, uid, ids, vals, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        # Lines may move from a period to another
+        self._touch_periods(cr, uid, ids, context)
+        ret = super(smile_activity_period_line, self).write(cr, uid, ids, vals, context)
+        self._touch_periods(cr, uid, ids, context)
+        return ret
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        self._touch_periods(cr, uid, ids, context)
+        return super(smile_activity_period_line, self).unlink(cr, uid, ids, context)
+
+
+    ## Custom methods
+
+    def _touch_periods(self, cr, uid, ids, context=None):
+        """ Increment the line stamps of the periods the given lines belong to
+        """
+        period_ids = set([l['period_id'] for l in self.read(cr, uid, ids, ['period_id'], context, load='_classic_write')])
+        touch_stamps(cr, [_get_line_stamp_name(period_id) for period_id in period_ids if period_id])
+
+
     ## Constraints methods
 
     #def _check_overlapping(self, cr, uid, ids, context=None):
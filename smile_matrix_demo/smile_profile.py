@@ -20,6 +20,7 @@
 ##############################################################################
 
 from osv import osv, fields
+from smile_matrix_field.matrix_field import matrix_resource_patch
 
 
 
@@ -30,4 +31,19 @@ class smile_activity_profile(osv.osv):
         'name': fields.char('Name', size=32, required=True),
         }
 
+
+    ## Native methods
+
+    @matrix_resource_patch
+    def create(self, cr, uid, vals, context=None):
+        return super(smile_activity_profile, self).create(cr, uid, vals, context)
+
+    @matrix_resource_patch
+    def write(self, cr, uid, ids, vals, context=None):
+        return super(smile_activity_profile, self).write(cr, uid, ids, vals, context)
+
+    @matrix_resource_patch
+    def unlink(self, cr, uid, ids, context=None):
+        return super(smile_activity_profile, self).unlink(cr, uid, ids, context)
+
 smile_activity_profile()
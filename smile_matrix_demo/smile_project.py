@@ -23,7 +23,8 @@ import datetime
 from dateutil.relativedelta import relativedelta
 
 from osv import osv, fields
-from smile_matrix_field.matrix_field import LINE_RENDERING_MODES
+from smile_matrix_field.matrix_field import matrix_resource_patch, LINE_RENDERING_MODES
+from smile_matrix_field.date_range import get_date_range
 
 
 
@@ -50,19 +51,14 @@ class smile_activity_project(osv.osv):
     ## Function fields
 
     def _get_month_range(self, cr, uid, ids, name, arg, context=None):
-        """ Get a list of date objects set to the first day of each month covering date range of the project.
+        """ Get the range of months covering the date range of the project, each month being represented by its first day.
             XXX It may make sense later to link the project to a set of smile.activity.period objects instead. This proposition has to be carefully evaluated.
         """
         result = {}
-        for project in self.browse(cr, uid, ids, context):
-            month_range = []
-            range_start = self._get_month_start(self._str_to_date(project.start_date))
-            range_end   = self._get_month_end(self._str_to_date(project.end_date))
-            date = range_start
-            while date <= range_end:
-                month_range.append(date)
-                date = date + relativedelta(months=1)
-            result[project.id] = month_range
+        for project in self.read(cr, uid, ids, ['start_date', 'end_date'], context, load='_classic_write'):
+            range_start = self._get_month_start(self._str_to_date(project['start_date']))
+            range_end   = self._get_month_end(self._str_to_date(project['end_date']))
+            result[project['id']] = get_date_range(range_start, range_end, unit='month')
         return result
 
 
@@ -84,6 +80,21 @@ class smile_activity_project(osv.osv):
         }
 
 
+    ## Native methods
+
+    @matrix_resource_patch
+    def create(self, cr, uid, vals, context=None):
+        return super(smile_activity_project, self).create(cr, uid, vals, context)
+
+    @matrix_resource_patch
+    def write(self, cr, uid, ids, vals, context=None):
+        return super(smile_activity_project, self).write(cr, uid, ids, vals, context)
+
+    @matrix_resource_patch
+    def unlink(self, cr, uid, ids, context=None):
+        return super(smile_activity_project, self).unlink(cr, uid, ids, context)
+
+
     ## Constraints methods
 
     def _check_start_date(self, cr, uid, ids, context=None):
@@ -24,7 +24,7 @@ import random
 import os
 
 from osv import osv, fields
-from smile_matrix_field.matrix_field import matrix, matrix_read_patch, matrix_write_patch, LINE_RENDERING_MODES
+from smile_matrix_field.matrix_field import matrix, matrix_read_patch, matrix_write_patch, matrix_vacuum, matrix_remove_duplicate_cells, LINE_RENDERING_MODES
 
 
 
@@ -76,6 +76,7 @@ class smile_activity_workload(osv.osv):
             cell_inverse_property='line_id',
             cell_value_property='quantity',
             cell_date_property='date',
+            direct_sql_write=True,
             date_range_property='date_range',
             date_format='%m/%y',
             navigation = True,
@@ -134,6 +135,11 @@ class smile_activity_workload(osv.osv):
 
     ## Custom methods
 
+    def vacuum_matrix_cells(self, cr, uid, ids=None, context=None):
+        """ Remove stale cells of the matrix. This method is called by a scheduled action.
+        """
+        return matrix_vacuum(self, cr, uid, ids, context)
+
     def modal_window_view(self, cr, uid, ids, context=None):
         return {
             'name':"View current form in modal window",
@@ -191,7 +197,7 @@ class smile_activity_workload_line(osv.osv):
 
     def create(self, cr, uid, vals, context=None):
         line_id = super(smile_activity_workload_line, self).create(cr, uid, vals, context)
-        # Create default cells
+        # Create default cells, except the ones provided with the line, like the cells submitted by the matrix
         line = self.browse(cr, uid, line_id, context)
         self.generate_cells(cr, uid, line, context)
         return line_id
@@ -200,12 +206,15 @@ class smile_activity_workload_line(osv.osv):
     ## Custom methods
 
     def generate_cells(self, cr, uid, line, context=None):
-        """ This method generate all cells between the date range.
+        """ This method generate all cells between the date range, skipping dates the line already has a cell for.
         """
+        existing_dates = set([str(cell.date) for cell in line.cell_ids])
         vals = {
             'line_id': line.id
             }
         for cell_date in line.workload_id.project_id.date_range:
+            if str(cell_date) in existing_dates:
+                continue
             vals.update({'date': cell_date})
             self.pool.get('smile.activity.workload.cell').create(cr, uid, vals, context)
         return
@@ -242,25 +251,31 @@ class smile_activity_workload_cell(osv.osv):
         return True
 
     def _check_date(self, cr, uid, ids, context=None):
-        for cell in self.browse(cr, uid, ids,context):
-            date = datetime.datetime.strptime(cell.date, '%Y-%m-%d')
-            workload = cell.line_id.workload_id
-            start_date = datetime.datetime.strptime(workload.start_date, '%Y-%m-%d')
-            end_date = datetime.datetime.strptime(workload.end_date, '%Y-%m-%d')
-            if date < start_date or date > end_date:
-                return False
-        return True
-
-    def _check_duplicate(self, cr, uid, ids, context=None):
-        for cell in self.browse(cr, uid, ids, context):
-            if len(self.search(cr, uid, [('date', '=', cell.date), ('line_id', '=', cell.line_id.id)], context=context)) > 1:
-                return False
-        return True
+        """ Check with a single query that cells are within the date range of their workload
+        """
+        if not ids:
+            return True
+        cr.execute("""SELECT c.id FROM smile_activity_workload_cell c
+            JOIN smile_activity_workload_line l ON l.id = c.line_id
+            JOIN smile_activity_workload r ON r.id = l.workload_id
+            JOIN smile_activity_project p ON p.id = r.project_id
+            WHERE c.id IN %s AND (c.date < p.start_date OR c.date > p.end_date)
+            LIMIT 1""", (tuple(ids), ))
+        return not cr.fetchone()
 
     _constraints = [
         #(_check_quantity, "Quantity can't be negative.", ['quantity']),
         (_check_date, "Cell date is out of the activity report date range.", ['date']),
-        (_check_duplicate, "Two cells can't share the same date.", ['date']),
         ]
 
+    _sql_constraints = [
+        ('line_date_unique', 'unique(line_id, date)', "Two cells can't share the same date."),
+        ]
+
+    def _auto_init(self, cr, context=None):
+        """ Remove duplicate cells first, else the unique constraint can't be added to the table
+        """
+        matrix_remove_duplicate_cells(self, cr, 'line_id', 'date')
+        return super(smile_activity_workload_cell, self)._auto_init(cr, context)
+
 smile_activity_workload_cell()
@@ -20,3 +20,4 @@
 ##############################################################################
 
 import matrix_field
+import matrix_stamp
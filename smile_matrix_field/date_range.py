@@ -0,0 +1,170 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2011-2012 Smile. All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import datetime
+from dateutil.relativedelta import relativedelta
+
+from lru_cache import LRUCache
+
+
+
+# Units a date range can be stepped by
+DATE_RANGE_UNITS = ['day', 'month']
+
+# Date ranges are immutable, so a single instance is shared by all the users of the same parameters
+_date_range_cache = LRUCache(size=1024)
+
+# Date ranges computed from records, indexed by database, model, record ID and stamp
+_record_date_range_cache = LRUCache(size=4096)
+
+
+
+class DateRange(object):
+    """ An immutable range of dates, from start to end by steps of days or months, minus some excluded dates.
+        It behaves like a sorted list of datetime.date objects, with membership tested in constant time.
+        Its string form is stable and can be turned back into a range with parse_date_range():
+            <unit>:<start>:<end>:<step>[:<exclusion bitmap>]
+        where dates are in ISO format, and the optional bitmap is the hexadecimal integer whose bit N is set if the Nth step of the range is excluded.
+    """
+
+    __slots__ = ('start', 'end', 'unit', 'step', 'exclusions', '_dates', '_date_set', '_serialized')
+
+    def __init__(self, start, end, unit='day', step=1, exclusions=None):
+        if unit not in DATE_RANGE_UNITS:
+            raise ValueError("%r is not a date range unit." % unit)
+        if step < 1:
+            raise ValueError("Date range step must be a positive integer.")
+        dates = []
+        i = 0
+        while True:
+            if unit == 'day':
+                date = start + datetime.timedelta(days=i * step)
+            else:
+                # Always step from the start date, to not drift on shorter months
+                date = start + relativedelta(months=i * step)
+            if date > end:
+                break
+            dates.append(date)
+            i += 1
+        exclusions = frozenset(exclusions or ())
+        # Only keep the exclusions that actually remove a date from the range, so equal ranges have equal exclusions
+        exclusions = frozenset([d for d in dates if d in exclusions])
+        serialized = "%s:%s:%s:%d" % (unit, start.isoformat(), end.isoformat(), step)
+        if exclusions:
+            bitmap = 0
+            for (i, d) in enumerate(dates):
+                if d in exclusions:
+                    bitmap |= 1 << i
+            serialized += ":%x" % bitmap
+        dates = tuple([d for d in dates if d not in exclusions])
+        for (name, value) in [('start', start), ('end', end), ('unit', unit), ('step', step), ('exclusions', exclusions), ('_dates', dates), ('_date_set', frozenset(dates)), ('_serialized', serialized)]:
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DateRange objects are immutable.")
+
+    def __iter__(self):
+        return iter(self._dates)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._dates[index])
+        return self._dates[index]
+
+    def __contains__(self, date):
+        return date in self._date_set
+
+    def index(self, date):
+        return self._dates.index(date)
+
+    def _key(self):
+        return (self.start, self.end, self.unit, self.step, self.exclusions)
+
+    def __eq__(self, other):
+        if isinstance(other, DateRange):
+            return self._key() == other._key()
+        if isinstance(other, (list, tuple)):
+            return list(self._dates) == list(other)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __str__(self):
+        return self._serialized
+
+    def __repr__(self):
+        return "DateRange(%r, %r, unit=%r, step=%r, exclusions=%r)" % (self.start, self.end, self.unit, self.step, sorted(self.exclusions))
+
+
+
+def get_date_range(start, end, unit='day', step=1, exclusions=None):
+    """ Return the date range built from these parameters, shared with all the callers using the same ones.
+    """
+    exclusions = frozenset(exclusions or ())
+    key = (start, end, unit, step, exclusions)
+    date_range = _date_range_cache.get(key)
+    if date_range is None:
+        date_range = DateRange(start, end, unit, step, exclusions)
+        _date_range_cache.set(key, date_range)
+    return date_range
+
+
+
+def parse_date_range(value):
+    """ Return the date range serialized in the given string by DateRange.__str__().
+        Parsed ranges are cached on their string, so parsing the same one again costs a single lookup.
+    """
+    date_range = _date_range_cache.get(value)
+    if date_range is not None:
+        return date_range
+    parts = value.split(':')
+    if len(parts) not in (4, 5):
+        raise ValueError("%r is not a serialized date range." % value)
+    (unit, start, end, step) = parts[:4]
+    start = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    step = int(step)
+    date_range = get_date_range(start, end, unit, step)
+    if len(parts) == 5:
+        bitmap = int(parts[4], 16)
+        date_range = get_date_range(start, end, unit, step, [d for (i, d) in enumerate(date_range) if bitmap >> i & 1])
+    _date_range_cache.set(value, date_range)
+    return date_range
+
+
+
+def get_record_date_range(dbname, model, res_id, stamp, compute):
+    """ Return the date range of a record, only calling compute() if none was cached for the same stamp.
+        The stamp must change as soon as the data the range is computed from are updated, like the write_date of the records involved.
+    """
+    key = (dbname, model, res_id, stamp)
+    date_range = _record_date_range_cache.get(key)
+    if date_range is None:
+        date_range = compute()
+        _record_date_range_cache.set(key, date_range)
+    return date_range
@@ -19,13 +19,52 @@
 #
 ##############################################################################
 
-from copy import deepcopy
+from array import array
+from collections import namedtuple
 import datetime
+import logging
+import re
 
-from osv import osv, fields, orm
+from osv import osv, fields
 from tools.func import wraps
 from tools.translate import _
 
+from lru_cache import LRUCache
+from date_range import DateRange, parse_date_range
+from matrix_stamp import get_stamps, touch_stamps
+
+
+
+_logger = logging.getLogger('smile_matrix_field')
+
+# Labels of resources new lines can be linked to, indexed by database, user, resource type, domain and language
+_resource_values_cache = LRUCache(size=256)
+
+
+
+# Matrix properties that can be evaluated dynamically on each object.
+# Dynamic properties are those which value is a string instead of their native type.
+# Of course this only works with properties which native type is not strings.
+DYNAMIC_PROPERTIES = [
+    'tree_definition',
+    'increment_values',
+    'cell_default_value',
+    'additional_columns',
+    'hide_line_title',
+    'hide_remove_line_buttons',
+    'hide_column_totals',
+    'hide_line_totals',
+    'column_totals_warning_threshold',
+    'editable_tree',
+    'hide_tree',
+    'css_classes',
+    'navigation',
+    'navigation_size',
+    'navigation_start',
+    'read_only',
+    'precision',
+    ]
+
 
 
 # List of values supported by the default_line_rendering parameter
@@ -52,6 +91,61 @@ def _get_prop(obj, prop_name, default_value=None):
 
 
 
+def _get_record_value(record, prop_name, default_value=None):
+    """ Get a property value from a record prefetched as a dictionnary by read()
+    """
+    if not prop_name or record is None or prop_name not in record:
+        return default_value
+    return record[prop_name]
+
+
+
+def _has_field(model_obj, field_name):
+    """ Tell if the model has the given field, including the ones inherited through _inherits
+    """
+    return field_name in model_obj._columns or field_name in model_obj._inherit_fields
+
+
+
+def _noiseless_add(total, value):
+    """ Add a value to a total, ignoring None values.
+        A total stays None as long as only None values were added to it, so the widget can leave empty totals blank.
+    """
+    if value is None:
+        return total
+    if total is None:
+        return value
+    return total + value
+
+
+
+# Match the representation of a list of datetime.date objects, and each of its dates
+_date_repr = r"datetime\.date\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)"
+_date_repr_regexp = re.compile(_date_repr)
+_date_list_repr_regexp = re.compile(r"^\[\s*(%s\s*(,\s*%s\s*)*,?\s*)?\]$" % (_date_repr, _date_repr))
+
+
+
+def _parse_date_range_string(range_name, value):
+    """ Parse a date range stored as text, either serialized by DateRange or as the representation of a list of dates
+    """
+    value = value.strip()
+    if not value:
+        return []
+    if value.startswith('['):
+        if not _date_list_repr_regexp.match(value):
+            raise osv.except_osv('Error !', "%s must return a list of datetime.date objects." % range_name)
+        try:
+            return [datetime.date(int(y), int(m), int(d)) for (y, m, d) in _date_repr_regexp.findall(value)]
+        except ValueError:
+            raise osv.except_osv('Error !', "%s returned an invalid date: %r." % (range_name, value))
+    try:
+        return parse_date_range(value)
+    except ValueError:
+        raise osv.except_osv('Error !', "%s returned an invalid date range: %r." % (range_name, value))
+
+
+
 def _get_date_range(base_object, date_range_property, visible_date_range_property, editable_date_range_property):
     """ Utility method to get the displayed date range and the visible date range.
         This piece of code was moved in its own method as date range extraction requires some special handling.
@@ -63,20 +157,22 @@ def _get_date_range(base_object, date_range_property, visible_date_range_propert
     # Get the editable date range. Default is to align this range on the visible date range.
     editable_date_range = _get_prop(base_object, editable_date_range_property, visible_date_range)
 
-    # date_range and visible_date_range values may be stored as text (or selection, which is the same). In this case, we need to evaluate them. It's bad, but it works.
+    # Date ranges may be stored as text (or selection, which is the same), in which case they have to be parsed
     if isinstance(date_range, (str, unicode)):
-        date_range = eval(date_range)
+        date_range = _parse_date_range_string(date_range_property, date_range)
     if isinstance(visible_date_range, (str, unicode)):
-        visible_date_range = eval(visible_date_range)
+        visible_date_range = _parse_date_range_string(visible_date_range_property, visible_date_range)
         if not visible_date_range:
             visible_date_range = date_range
     if isinstance(editable_date_range, (str, unicode)):
-        editable_date_range = eval(editable_date_range)
+        editable_date_range = _parse_date_range_string(editable_date_range_property, editable_date_range)
         if not editable_date_range:
             editable_date_range = visible_date_range
 
-    # Check the data structure returned by date ranges
+    # Check the data structure returned by date ranges. DateRange objects only contain dates by construction.
     for (range_name, range_data) in [(date_range_property, date_range), (visible_date_range_property, visible_date_range), (editable_date_range_property, editable_date_range)]:
+        if isinstance(range_data, DateRange):
+            continue
         if type(range_data) is not type([]):
             raise osv.except_osv('Error !', "%s must return a list of datetime.date objects." % range_name)
         for d in range_data:
@@ -87,6 +183,15 @@ def _get_date_range(base_object, date_range_property, visible_date_range_propert
 
 
 
+def _get_date_set(date_range):
+    """ Return a collection of the dates of a range with constant time membership tests
+    """
+    if isinstance(date_range, DateRange):
+        return date_range
+    return set(date_range)
+
+
+
 
 class matrix(fields.dummy):
     """ A custom field to prepare data for, and mangle data from, the matrix widget.
@@ -132,6 +237,9 @@ class matrix(fields.dummy):
             # TODO: this parameter only works for selection field, make it work with all widgets
             'cell_value_range': conf_dict.get('cell_value_range', None),
             'cell_value_default_range': conf_dict.get('cell_value_default_range', None),
+            # Save cells with set-based SQL queries instead of the ORM. Constraints are checked once for all saved cells.
+            # Only works if cell_value_property is a plain stored float column.
+            'direct_sql_write': conf_dict.get('direct_sql_write', False),
 
             # Property name of the relation field on which we'll call the date_range property
             'date_range_property': conf_dict.get('date_range_property', None),
@@ -141,6 +249,10 @@ class matrix(fields.dummy):
             'navigation': conf_dict.get('navigation', False),          # Enable navigation slider
             'navigation_size': conf_dict.get('navigation_size', 10),   # Navigation slider size
             'navigation_start': conf_dict.get('navigation_start', 1),  # Start position
+            # Only compute and send the cells of the navigation window, plus a margin on each side (defaults to navigation_size).
+            # Other columns are loaded on demand by the widget as the slider moves.
+            'navigation_window': conf_dict.get('navigation_window', False),
+            'navigation_margin': conf_dict.get('navigation_margin', None),
 
             # The format we use to display date labels
             'date_format': conf_dict.get('date_format', "%Y-%m-%d"),
@@ -195,6 +307,10 @@ class matrix(fields.dummy):
 
             # Float rounding precision
             'precision': conf_dict.get('precision', 2),
+
+            # Send cells in a compact columnar format: for each line, a list of values aligned on the date range, a string
+            # of read-only flags ('0' or '1' per date) and indexes of value ranges in a palette shared by the whole matrix.
+            'compact_format': conf_dict.get('compact_format', False),
         }
 
         # Check that all required parameters are there
@@ -243,19 +359,412 @@ class matrix(fields.dummy):
             date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
         return date
 
-    def _get_title_or_id(self, obj):
-        """ Return the title of the object or a descriptive string"""
-        return isinstance(obj, orm.browse_record) and getattr(obj, 'name_get')()[0][1] or obj or _("Untitled")
+    def _index_cells_by_date(self, cells, date_property, visible_dates):
+        """ Index prefetched cells by their date, parsing each date only once.
+            Return a date-indexed dict of cells and the list of IDs of cells that are out of the visible range or duplicates.
+        """
+        cells_by_date = {}
+        stale_cell_ids = []
+        for cell in cells:
+            cell_date = self._str_to_date(cell[date_property])
+            if cell_date not in visible_dates or cell_date in cells_by_date:
+                stale_cell_ids.append(cell['id'])
+                continue
+            cells_by_date[cell_date] = cell
+        return (cells_by_date, stale_cell_ids)
+
+    def _init_cells(self, line_data, size, compact=False):
+        """ Prepare the line to receive its cells, either indexed by date or in the compact format of the given size
+        """
+        line_data['cells_data'] = {}
+        if compact:
+            line_data.update({
+                'values': [None] * size,
+                'read_only_mask': ['0'] * size,
+                'value_ranges': [None] * size,
+                })
+
+    def _set_cell(self, line_data, date_str, date_index, cell_value, cell_value_range, read_only_cell, palette=None):
+        """ Store a cell in the line, in the compact format if a palette is provided.
+            The palette is a dict mapping each distinct value range to its index.
+        """
+        if palette is None:
+            line_data['cells_data'][date_str] = {
+                'value': cell_value,
+                'value_range': cell_value_range,
+                'read_only': read_only_cell,
+                }
+            return
+        line_data['values'][date_index] = cell_value
+        if read_only_cell:
+            line_data['read_only_mask'][date_index] = '1'
+        if cell_value_range is not None:
+            range_key = tuple(cell_value_range)
+            if range_key not in palette:
+                palette[range_key] = len(palette)
+            line_data['value_ranges'][date_index] = palette[range_key]
+
+    def _fill_line_cells(self, conf, line_data, cells, dates, editable_dates, date_strs, date_indexes, palette=None):
+        """ Pack in the line its cells of the given dates, as indexed by _index_cells_by_date(). Invisible cells are left out.
+        """
+        for d in dates:
+            # Find the cell corresponding to the date in the date_range
+            cell = cells.get(d, None)
+            # Get the current value and its allowed range
+            cell_value_range = conf['cell_value_range']
+            if isinstance(cell_value_range, (str, unicode)):
+                cell_value_range = _get_record_value(cell, conf['cell_value_range'], conf['cell_value_default_range'])
+            cell_value = _get_record_value(cell, conf['cell_value_property'], conf['cell_default_value'])
+            # Skip the cell to hide it if its visible property is True
+            visible_cell = _get_record_value(cell, conf['cell_visible_property'], True)
+            if not visible_cell:
+                continue
+            # Set cell editability according its dynamic property.
+            read_only_cell = _get_record_value(cell, conf['cell_readonly_property'], False)
+            if line_data.get('read_only', False):
+                # If the line is readonly then the cell is force to readonly.
+                read_only_cell = True
+            elif d not in editable_dates:
+                # Column-level options override cells-level visibility properties
+                read_only_cell = True
+            # Pack all properties of the cell
+            i = date_indexes[d]
+            self._set_cell(line_data, date_strs[i], i, cell_value, cell_value_range, read_only_cell, palette)
+
+    def _get_row_values(self, conf, cells, dates, date_indexes, size):
+        """ Return the values of the visible cells of a line at the given dates, aligned on a date range of the given size
+        """
+        row = [None] * size
+        for d in dates:
+            cell = cells.get(d, None)
+            if _get_record_value(cell, conf['cell_visible_property'], True):
+                row[date_indexes[d]] = _get_record_value(cell, conf['cell_value_property'], conf['cell_default_value'])
+        return row
+
+    def _serialize_palette(self, matrix_data, palette):
+        """ Serialize read-only flags of the compact format and return value ranges ordered by their index in the palette, or None for the default format
+        """
+        if palette is None:
+            return None
+        for line_data in matrix_data:
+            line_data['read_only_mask'] = ''.join(line_data['read_only_mask'])
+        return [list(r) for (r, i) in sorted(palette.items(), key=lambda x: x[1])]
+
+    def _get_path_key(self, resource_values):
+        """ Return the key identifying a branch of the resource tree from the resource values leading to it
+        """
+        return ','.join([str(v) for v in resource_values])
+
+    def _compute_totals(self, conf, matrix_data, date_strs, rows=None):
+        """ Compute once all totals and subtotals displayed by the widget, from a dense list of values per line aligned on the date range.
+            Values of lines found in rows, indexed by line ID, are taken from there instead of the cells sent to the widget, which may only cover a window of dates.
+            Returns a dict with:
+              * row_totals: total of each line, indexed by line ID;
+              * column_totals, column_warnings: total of each date and whether it exceeds the warning threshold, both aligned on the date range;
+              * grand_total: total of all lines;
+              * additional_totals: total of each additional column, indexed by its line property;
+              * subtotals: values, total and additional column totals of each branch of the resource tree, indexed by _get_path_key().
+            Like the widget, column and grand totals ignore header and spacer lines, and all sums are None when there is nothing to add.
+        """
+        additional_properties = [c['line_property'] for c in conf['additional_columns'] if 'line_property' in c]
+        tree_depth = len(conf['tree_definition'])
+        threshold = conf['column_totals_warning_threshold']
+        size = len(date_strs)
+        date_indexes = dict([(d, i) for (i, d) in enumerate(date_strs)])
+        totals = {
+            'row_totals': {},
+            'column_totals': [None] * size,
+            'column_warnings': [False] * size,
+            'grand_total': None,
+            'additional_totals': dict([(p, None) for p in additional_properties]),
+            'subtotals': {},
+            }
+        for line in matrix_data:
+            if rows is not None and line['id'] in rows:
+                row = rows[line['id']]
+            elif 'values' in line:
+                row = line['values']
+            else:
+                row = [None] * size
+                for (d, cell) in line.get('cells_data', {}).items():
+                    if d in date_indexes:
+                        row[date_indexes[d]] = cell['value']
+            row_total = None
+            for v in row:
+                row_total = _noiseless_add(row_total, v)
+            totals['row_totals'][str(line['id'])] = row_total
+            if line.get('position', 'body') in ['top', 'bottom']:
+                continue
+            additional_values = [(p, line.get('cells_data', {}).get(p, {}).get('value')) for p in additional_properties]
+            for (p, v) in additional_values:
+                totals['additional_totals'][p] = _noiseless_add(totals['additional_totals'][p], v)
+            if line['widget'] not in ['header', 'spacer']:
+                totals['column_totals'] = [_noiseless_add(t, v) for (t, v) in zip(totals['column_totals'], row)]
+                totals['grand_total'] = _noiseless_add(totals['grand_total'], row_total)
+            # Branches of the tree only group real lines
+            if line['id'] == 'template':
+                continue
+            resource_values = [r['value'] for r in line.get('resources', [])]
+            for level in range(1, tree_depth):
+                subtotal = totals['subtotals'].setdefault(self._get_path_key(resource_values[:level]), {
+                    'values': [None] * size,
+                    'total': None,
+                    'additional': dict([(p, None) for p in additional_properties]),
+                    })
+                subtotal['values'] = [_noiseless_add(t, v) for (t, v) in zip(subtotal['values'], row)]
+                subtotal['total'] = _noiseless_add(subtotal['total'], row_total)
+                for (p, v) in additional_values:
+                    subtotal['additional'][p] = _noiseless_add(subtotal['additional'][p], v)
+        if threshold is not None:
+            totals['column_warnings'] = [t is not None and t > threshold for t in totals['column_totals']]
+        return totals
+
+    def _build_resource_tree(self, resource_value_list, matrix_data, subtotals):
+        """ Group the lines of the matrix body by resource, following the levels of the tree definition, in a single pass.
+            Returns the root node of the tree. Each node has:
+              * children: its sub-nodes, in the order of the resource values of their level;
+              * line_indexes: positions in matrix_data of the lines it directly holds, only set on the nodes of the last level;
+              * resources: the resources leading to the node, like the ones of lines;
+              * totals: the subtotals of the node, as computed by _compute_totals().
+            Like the widget always did, lines linked to a resource which is not in the values of its level are left out of the tree.
+        """
+        # Get the position and label of each resource value, except for the last level which is not part of the tree
+        value_indexes = []
+        value_labels = []
+        for res_def in resource_value_list[:-1]:
+            value_indexes.append(dict([(v, i) for (i, (v, label)) in enumerate(res_def['values'])]))
+            value_labels.append(dict(res_def['values']))
+        root = {'children': {}, 'line_indexes': [], 'resources': []}
+        for (line_index, line) in enumerate(matrix_data):
+            if line['id'] == 'template' or line.get('position', 'body') in ['top', 'bottom']:
+                continue
+            node = root
+            for (level, res) in enumerate(line['resources'][:len(value_indexes)]):
+                if res['value'] not in value_indexes[level]:
+                    node = None
+                    break
+                if res['value'] not in node['children']:
+                    node['children'][res['value']] = {
+                        'children': {},
+                        'line_indexes': [],
+                        'resources': node['resources'] + [{
+                            'id': res['id'],
+                            'label': value_labels[level][res['value']],
+                            'value': res['value'],
+                            }],
+                        }
+                node = node['children'][res['value']]
+            if node is not None:
+                node['line_indexes'].append(line_index)
+        # Sort children and attach their subtotals, level by level
+        nodes = [(root, 0)]
+        while nodes:
+            (node, level) = nodes.pop()
+            children = sorted(node['children'].values(), key=lambda child: value_indexes[level][child['resources'][-1]['value']])
+            node['children'] = children
+            for child in children:
+                child['totals'] = subtotals.get(self._get_path_key([r['value'] for r in child['resources']]), {})
+                nodes.append((child, level + 1))
+        return root
+
+    def _get_window_dates(self, conf, date_range, window_bounds=None):
+        """ Return the set of dates for which cells have to be loaded, or None if all of them are required.
+            window_bounds let the widget ask for an explicit (first, last) date window, as YYYYMMDD strings.
+        """
+        if not (conf['navigation'] and conf['navigation_window']):
+            return None
+        if window_bounds:
+            (first_date, last_date) = [datetime.datetime.strptime(d, '%Y%m%d').date() for d in window_bounds]
+            return set([d for d in date_range if first_date <= d <= last_date])
+        margin = conf['navigation_margin']
+        if margin is None:
+            margin = conf['navigation_size']
+        start = max(0, conf['navigation_start'] - 1 - margin)
+        stop = max(0, conf['navigation_start'] - 1 + conf['navigation_size'] + margin)
+        return set(date_range[start:stop])
+
+    def _is_resource_patched(self, model_obj):
+        """ Tell if the model reports the changes of its objects, i.e. if its create(), write() and unlink() methods are decorated by matrix_resource_patch().
+        """
+        for method_name in ['create', 'write', 'unlink']:
+            if not getattr(getattr(model_obj, method_name), 'matrix_resource_patch', False):
+                return False
+        return True
+
+    def _search_resource_values(self, pool, cr, uid, requests, ids_by_model, context=None):
+        """ Search resources matching each of the (resource type, domain) requests.
+            Lists of (ID, label) are taken from the cache when available, for models patched by matrix_resource_patch(). They are cached against the committed stamp of the model, which is incremented in the same transaction as any creation, update or removal of its resources.
+            For the others, IDs of found resources are added to ids_by_model to let the caller fetch their labels along with others, then call _cache_resource_values().
+            Return a dict indexed by request keys of either (ID, label) lists for cache hits, or (resource type, resource IDs, cache key, stamp) for cache misses.
+        """
+        # Get the committed stamps of all patched models at once
+        patched_types = set([res_type for (res_type, res_domain) in requests.values() if self._is_resource_patched(pool.get(res_type))])
+        stamps = get_stamps(cr, [_get_resource_stamp_name(res_type) for res_type in patched_types])
+        resource_values = {}
+        for (request_key, (res_type, res_domain)) in requests.items():
+            res_obj = pool.get(res_type)
+            stamp = stamps.get(_get_resource_stamp_name(res_type), None)
+            cache_key = (cr.dbname, uid, res_type, request_key[1], (context or {}).get('lang'))
+            if stamp is not None:
+                cached = _resource_values_cache.get(cache_key)
+                if cached is not None and cached[0] == stamp:
+                    resource_values[request_key] = cached[1]
+                    continue
+            res_ids = res_obj.search(cr, uid, res_domain, context=context)
+            ids_by_model.setdefault(res_type, []).extend(res_ids)
+            resource_values[request_key] = (res_type, res_ids, cache_key, stamp)
+        return resource_values
+
+    def _cache_resource_values(self, cr, resource_values, labels, context=None):
+        """ Build (ID, label) lists of resources missed in cache by _search_resource_values(), then cache them.
+        """
+        for (request_key, values) in resource_values.items():
+            if not isinstance(values, tuple):
+                continue
+            (res_type, res_ids, cache_key, stamp) = values
+            # Keep the order returned by the search
+            values = [(res_id, labels[res_type].get(res_id, _("Untitled"))) for res_id in res_ids]
+            if stamp is not None:
+                _resource_values_cache.set(cache_key, (stamp, values))
+            resource_values[request_key] = values
+        return resource_values
+
+    def _name_get_batch(self, pool, cr, uid, ids_by_model, context=None):
+        """ Get labels of all the provided objects with a single name_get() call per model.
+            Return a dict of labels indexed by model and object ID.
+        """
+        labels = {}
+        for (model, model_ids) in ids_by_model.items():
+            model_ids = list(set([i for i in model_ids if i]))
+            labels[model] = model_ids and dict(pool.get(model).name_get(cr, uid, model_ids, context)) or {}
+        return labels
 
     def _get_translations(self, cr, conf, context):
+        """ Return translated copies of the labels of the provided configuration
+        """
+        translations = {}
         if conf.get('title'):
-            conf['title'] = _(conf['title'])
-        if conf.get('additional_columns'):
-            for index, column in enumerate(conf['additional_columns']):
-                conf['additional_columns'][index]['label'] = _(column['label'])
+            translations['title'] = _(conf['title'])
+        if isinstance(conf.get('additional_columns'), list):
+            translations['additional_columns'] = []
+            for column in conf['additional_columns']:
+                column = column.copy()
+                column['label'] = _(column['label'])
+                translations['additional_columns'].append(column)
         if conf.get('total_label'):
-            conf['total_label'] = _(conf['total_label'])
-        return conf
+            translations['total_label'] = _(conf['total_label'])
+        return translations
+
+    def _get_cached_translations(self, cr, context):
+        """ Translate labels of the matrix configuration once per database and language
+        """
+        cache_key = (cr.dbname, (context or {}).get('lang'))
+        if cache_key not in self._translations_cache:
+            self._translations_cache[cache_key] = self._get_translations(cr, self.matrix_conf, context)
+        return self._translations_cache[cache_key]
+
+
+    def _prefetch(self, obj, cr, uid, ids, conf, date_bounds=None, extra_line_fields=None, context=None):
+        """ Fetch lines and cells of all the given objects at once, to not let the ORM fetch them lazily one by one.
+            If date_bounds is provided, only cells between these (first, last) dates are fetched.
+            Line properties listed in extra_line_fields are read along with the ones the matrix always needs.
+            Return the IDs of body and bottom lines of each object, the data of all lines indexed by their IDs, and the data of all cells grouped by the line they belongs to.
+        """
+        line_pool = obj.pool.get(conf['line_type'])
+        cell_pool = obj.pool.get(conf['cell_type'])
+
+        # Get the IDs of the lines of all objects in one query
+        line_ids_by_object = {}
+        all_line_ids = set()
+        line_properties = [p for p in [conf['line_property'], conf['additional_line_property']] if p]
+        for base_data in obj.read(cr, uid, ids, line_properties, context):
+            body_line_ids = base_data.get(conf['line_property']) or []
+            bottom_line_ids = conf['additional_line_property'] and base_data.get(conf['additional_line_property']) or []
+            line_ids_by_object[base_data['id']] = (body_line_ids, bottom_line_ids)
+            all_line_ids.update(body_line_ids + bottom_line_ids)
+        all_line_ids = list(all_line_ids)
+
+        lines = {}
+        cells_by_line = dict([(line_id, []) for line_id in all_line_ids])
+        if all_line_ids:
+            # Read all line properties used by the matrix in one query
+            line_fields = [conf['line_rendering_dynamic_property'], conf['line_removable_property']] + [res['line_property'] for res in conf['tree_definition']] + list(extra_line_fields or [])
+            line_fields = [f for f in set(line_fields) if f and _has_field(line_pool, f)]
+            lines = dict([(l['id'], l) for l in line_pool.read(cr, uid, all_line_ids, line_fields, context, load='_classic_write')])
+
+            # Read all cells of all lines in one query, and regroup them by line
+            cell_fields = [conf['cell_inverse_property'], conf['cell_date_property'], conf['cell_value_property'], conf['cell_visible_property'], conf['cell_readonly_property']]
+            if isinstance(conf['cell_value_range'], (str, unicode)):
+                cell_fields.append(conf['cell_value_range'])
+            cell_fields = [f for f in set(cell_fields) if f and _has_field(cell_pool, f)]
+            cell_domain = [(conf['cell_inverse_property'], 'in', all_line_ids)]
+            if date_bounds:
+                cell_domain += [
+                    (conf['cell_date_property'], '>=', date_bounds[0].strftime('%Y-%m-%d')),
+                    (conf['cell_date_property'], '<=', date_bounds[1].strftime('%Y-%m-%d')),
+                    ]
+            cell_ids = cell_pool.search(cr, uid, cell_domain, context=context)
+            for cell in cell_pool.read(cr, uid, cell_ids, cell_fields, context, load='_classic_write'):
+                cells_by_line.setdefault(cell[conf['cell_inverse_property']], []).append(cell)
+
+        return (line_ids_by_object, lines, cells_by_line)
+
+
+    def _prefetch_cell_values(self, obj, cr, uid, conf, line_ids, context=None):
+        """ Fetch the value and visibility of all cells of the given lines, to compute totals over the whole date range when only a window of cells is loaded.
+            Cells are read with a single SQL query if these properties are stored columns and no record rule applies to cells, with the ORM otherwise.
+            Return the cells grouped by the line they belongs to, like _prefetch().
+        """
+        cell_pool = obj.pool.get(conf['cell_type'])
+        cells_by_line = dict([(line_id, []) for line_id in line_ids])
+        if not line_ids:
+            return cells_by_line
+        cell_fields = [conf['cell_inverse_property'], conf['cell_date_property'], conf['cell_value_property'], conf['cell_visible_property']]
+        cell_fields = [f for f in set(cell_fields) if f and _has_field(cell_pool, f)]
+        # Fields inherited through _inherits are stored in the table of the parent model
+        stored = _has_field(cell_pool, 'active') == ('active' in cell_pool._columns)
+        for f in cell_fields:
+            if f not in cell_pool._columns or isinstance(cell_pool._columns[f], (fields.function, fields.one2many, fields.many2many)):
+                stored = False
+        if stored:
+            obj.pool.get('ir.model.access').check(cr, uid, cell_pool._name, 'read', context=context)
+            stored = not obj.pool.get('ir.rule').domain_get(cr, uid, cell_pool._name, 'read', context=context)[0]
+        if stored:
+            query = 'SELECT id, %s FROM "%s" WHERE "%s" IN %%s' % (', '.join(['"%s"' % f for f in cell_fields]), cell_pool._table, conf['cell_inverse_property'])
+            if 'active' in cell_pool._columns:
+                query += ' AND active = true'
+            # Keep the order of the ORM, which decides which duplicate cell is displayed
+            query += ' ORDER BY %s, id' % cell_pool._order
+            cr.execute(query, (tuple(line_ids), ))
+            cells = cr.dictfetchall()
+        else:
+            cell_ids = cell_pool.search(cr, uid, [(conf['cell_inverse_property'], 'in', line_ids)], context=context)
+            cells = cell_pool.read(cr, uid, cell_ids, cell_fields, context, load='_classic_write')
+        for cell in cells:
+            cells_by_line.setdefault(cell[conf['cell_inverse_property']], []).append(cell)
+        return cells_by_line
+
+    def _get_stale_cells(self, obj, cr, uid, ids, context=None):
+        """ Sort cells of the given objects between the ones the matrix displays and the stale ones.
+            Stale cells are those out of the visible date range, duplicates and invisible ones.
+            Return the set of IDs of kept cells and the set of IDs of stale cells.
+        """
+        conf = self.matrix_conf
+        (line_ids_by_object, lines_data, cells_by_line) = self._prefetch(obj, cr, uid, ids, conf, context=context)
+        kept_cell_ids = set()
+        stale_cell_ids = set()
+        for base_object in obj.browse(cr, uid, ids, context):
+            visible_dates = _get_date_set(_get_date_range(base_object, conf['date_range_property'], conf['visible_date_range_property'], conf['editable_date_range_property'])[1])
+            (body_line_ids, bottom_line_ids) = line_ids_by_object.get(base_object.id, ([], []))
+            for line_id in body_line_ids + bottom_line_ids:
+                (cells, line_stale_cell_ids) = self._index_cells_by_date(cells_by_line.get(line_id, []), conf['cell_date_property'], visible_dates)
+                stale_cell_ids.update(line_stale_cell_ids)
+                for cell in cells.values():
+                    if _get_record_value(cell, conf['cell_visible_property'], True):
+                        kept_cell_ids.add(cell['id'])
+                    else:
+                        stale_cell_ids.add(cell['id'])
+        return (kept_cell_ids, stale_cell_ids)
 
 
     ## Native methods
@@ -264,61 +773,180 @@ class matrix(fields.dummy):
         #arg = (args['line_type'], args['line_inverse_property'], "Matrix lines")
         #args.update({'type': 'one2many'})
         super(matrix, self).__init__(*arg, **args)
-        # Parse and store matrix config
+        # Parse and store matrix config. It is shared by all reads and must not be altered.
         self.matrix_conf = self._parse_conf(args)
+        # Precompute the list of properties that have to be evaluated on each object
+        self._dynamic_properties = [p for p in DYNAMIC_PROPERTIES if isinstance(self.matrix_conf[p], (str, unicode))]
+        self._translations_cache = {}
+
+    def _get_object_conf(self, base_object, translations, window_bounds=None):
+        """ Return the configuration of the matrix of the given object, its date ranges, and the dates of cells to load
+        """
+        # Each object gets its own shallow copy of the static configuration
+        conf = self.matrix_conf.copy()
+        conf.update(translations)
+
+        # Evaluate dynamic matrix properties
+        for flag_id in self._dynamic_properties:
+            conf[flag_id] = bool(_get_prop(base_object, self.matrix_conf[flag_id]))
+
+        # Get our date ranges, and the dates of cells to load
+        (date_range, visible_date_range, editable_date_range) = _get_date_range(base_object, conf['date_range_property'], conf['visible_date_range_property'], conf['editable_date_range_property'])
+        loaded_dates = self._get_window_dates(conf, date_range, window_bounds)
+        return (conf, date_range, visible_date_range, editable_date_range, loaded_dates)
+
+    def _get_date_bounds(self, objects_conf):
+        """ Return the (first, last) dates of cells to fetch for all objects, or None if all cells are required
+        """
+        # Only fetch cells of the date windows if all objects are windowed
+        all_loaded_dates = [o[4] for o in objects_conf.values()]
+        if not all_loaded_dates or None in all_loaded_dates:
+            return None
+        all_loaded_dates = set().union(*all_loaded_dates)
+        return all_loaded_dates and (min(all_loaded_dates), max(all_loaded_dates)) or None
+
+    def _read_window(self, obj, cr, uid, ids, window_bounds, context=None):
+        """ Only read the cells of the given (first, last) window of dates, for the widget to load columns on demand.
+            Labels, resources, additional columns, totals and the resource tree were sent with the matrix itself, so they are left out.
+        """
+        objects_conf = {}
+        for base_object in obj.browse(cr, uid, ids, context):
+            objects_conf[base_object.id] = self._get_object_conf(base_object, {}, window_bounds)
+        (line_ids_by_object, lines_data, cells_by_line) = self._prefetch(obj, cr, uid, ids, self.matrix_conf, self._get_date_bounds(objects_conf), context=context)
+
+        matrix_list = {}
+        for (object_id, (conf, date_range, visible_date_range, editable_date_range, loaded_dates)) in objects_conf.items():
+            visible_dates = _get_date_set(visible_date_range)
+            editable_dates = _get_date_set(editable_date_range)
+            date_strs = [self._date_to_str(d) for d in date_range]
+            date_indexes = dict([(d, i) for (i, d) in enumerate(date_range)])
+            window_dates = [d for d in visible_date_range if d in date_indexes and (loaded_dates is None or d in loaded_dates)]
+            palette = None
+            if conf['compact_format']:
+                palette = {}
+            matrix_data = []
+            (body_line_ids, bottom_line_ids) = line_ids_by_object.get(object_id, ([], []))
+            for (line_id, read_only) in [(i, False) for i in body_line_ids] + [(i, True) for i in bottom_line_ids]:
+                line_data = {
+                    'id': line_id,
+                    'widget': _get_record_value(lines_data[line_id], conf['line_rendering_dynamic_property'], conf['default_line_rendering']),
+                    'read_only': read_only,
+                    }
+                cells = self._index_cells_by_date(cells_by_line.get(line_id, []), conf['cell_date_property'], visible_dates)[0]
+                self._init_cells(line_data, len(date_range), conf['compact_format'])
+                self._fill_line_cells(conf, line_data, cells, window_dates, editable_dates, date_strs, date_indexes, palette)
+                matrix_data.append(line_data)
+            matrix_list[object_id] = {
+                'matrix_data': matrix_data,
+                'date_range': date_strs,
+                'value_range_palette': self._serialize_palette(matrix_data, palette),
+                'loaded_date_range': [self._date_to_str(d) for d in date_range if loaded_dates is None or d in loaded_dates],
+                }
+        return matrix_list
 
     def _fnct_read(self, obj, cr, uid, ids, field_name, args, context=None):
         """ Dive into object lines and cells, and organize their info to let the matrix widget understand them
         """
-        matrix_conf = deepcopy(self.matrix_conf)
-        conf = self._get_translations(cr, matrix_conf, context)
+        # The widget can ask for an explicit window of dates to load
+        window_bounds = (context or {}).get('matrix_window', {}).get(field_name, None)
+        if window_bounds:
+            return self._read_window(obj, cr, uid, ids, window_bounds, context)
+
+        translations = self._get_cached_translations(cr, context)
+        line_type = self.matrix_conf['line_type']
+        tree_definition = self.matrix_conf['tree_definition']
+        base_objects = obj.browse(cr, uid, ids, context)
+
+        objects_conf = {}
+        resource_requests = {}
+        resource_keys = {}
+        for base_object in base_objects:
+            objects_conf[base_object.id] = self._get_object_conf(base_object, translations)
+
+            # Compute the domain of each tree level, by merging its static and dynamic definition
+            resource_keys[base_object.id] = []
+            for level_def in tree_definition:
+                res_domain = level_def.get('domain', []) + _get_prop(base_object, level_def.get('dynamic_domain_property', None), [])
+                request_key = (level_def['resource_type'], repr(res_domain))
+                resource_requests[request_key] = (level_def['resource_type'], res_domain)
+                resource_keys[base_object.id].append(request_key)
+
+        date_bounds = self._get_date_bounds(objects_conf)
+
+        # Additional columns may differ between objects: read the properties of all of them for all lines at once
+        additional_properties = set()
+        for object_conf in objects_conf.values():
+            additional_columns = object_conf[0]['additional_columns']
+            if isinstance(additional_columns, list):
+                additional_properties.update([c['line_property'] for c in additional_columns if 'line_property' in c])
+
+        # Fetch all lines and cells of all objects upfront
+        (line_ids_by_object, lines_data, cells_by_line) = self._prefetch(obj, cr, uid, ids, self.matrix_conf, date_bounds, additional_properties, context)
+        # Totals cover the whole date range, even if only a window of cells is sent to the widget
+        all_cells_by_line = cells_by_line
+        if date_bounds is not None:
+            all_cells_by_line = self._prefetch_cell_values(obj, cr, uid, self.matrix_conf, lines_data.keys(), context)
+
+        # Collect all objects we need a label for, to get them with a single name_get() call per model
+        ids_by_model = {line_type: lines_data.keys()}
+        for level_def in tree_definition:
+            ids_by_model.setdefault(level_def['resource_type'], []).extend([l.get(level_def['line_property']) for l in lines_data.values()])
+        resource_values = self._search_resource_values(obj.pool, cr, uid, resource_requests, ids_by_model, context)
+        labels = self._name_get_batch(obj.pool, cr, uid, ids_by_model, context)
+        resource_values = self._cache_resource_values(cr, resource_values, labels, context)
+
         # Browse through all objects on which our matrix field is defined
         matrix_list = {}
-        for base_object in obj.browse(cr, uid, ids, context):
+        for base_object in base_objects:
             matrix_data = []
-
-            # Evaluate dynamic matrix properties
-            # Dynamic properties are those which value is a string instead of their native type
-            # Of course this only works with properties which native type is not strings
-            for flag_id in ['tree_definition', 'increment_values', 'cell_default_value', 'additional_columns', 'hide_line_title', 'hide_remove_line_buttons', 'hide_column_totals', 'hide_line_totals', 'column_totals_warning_threshold', 'editable_tree', 'hide_tree', 'css_classes', 'navigation', 'navigation_size', 'navigation_start', 'read_only', 'precision']:
-                flag_value = conf[flag_id]
-                if isinstance(flag_value, (str, unicode)):
-                    conf[flag_id] = bool(_get_prop(base_object, flag_value))
-
-            # Get our date ranges
-            (date_range, visible_date_range, editable_date_range) = _get_date_range(base_object, conf['date_range_property'], conf['visible_date_range_property'], conf['editable_date_range_property'])
+            (conf, date_range, visible_date_range, editable_date_range, loaded_dates) = objects_conf[base_object.id]
+            # Use sets for fast date membership tests
+            visible_dates = _get_date_set(visible_date_range)
+            editable_dates = _get_date_set(editable_date_range)
+            date_strs = [self._date_to_str(d) for d in date_range]
+            date_keys = set(date_strs)
+            date_indexes = dict([(d, i) for (i, d) in enumerate(date_range)])
+            # Visible dates out of the displayed range have no column to be rendered in
+            displayed_dates = [d for d in visible_date_range if d in date_indexes]
+            # Skip dates out of the window, the widget will load them later
+            loaded_displayed_dates = [d for d in displayed_dates if loaded_dates is None or d in loaded_dates]
+            # Value ranges of the compact format are shared by all cells of the matrix
+            palette = None
+            if conf['compact_format']:
+                palette = {}
+            # Values of all cells of windowed lines, for totals
+            rows = {}
 
             # Get the list of all objects new rows of the matrix can be linked to
             # Keep the original order defined in matrix properties
             resource_value_list = []
-            for level_def in conf['tree_definition']:
+            for (level_def, request_key) in zip(tree_definition, resource_keys[base_object.id]):
                 res_def = level_def.copy()
                 res_id = res_def.pop('line_property')
-                res_type = res_def.pop('resource_type')
-                p = base_object.pool.get(res_type)
-                # Compute domain by merging its static and dynamic definition
-                res_domain = res_def.pop('domain', []) + _get_prop(base_object, res_def.pop('dynamic_domain_property', None), [])
+                for p in ['resource_type', 'domain', 'dynamic_domain_property']:
+                    res_def.pop(p, None)
                 # Build up the resource definition
                 res_def.update({
                     'id': res_id,
-                    'values': [(o.id, self._get_title_or_id(o)) for o in p.browse(cr, uid, p.search(cr, uid, res_domain, context=context), context)],
+                    'values': resource_values[request_key],
                     })
                 resource_value_list.append(res_def)
 
-            # Browse all lines that will compose the main part of the matrix
-            lines = [(line, {'position': 'body'}) for line in _get_prop(base_object, conf['line_property'], [])]
+            # Get all lines that will compose the main part of the matrix
+            (body_line_ids, bottom_line_ids) = line_ids_by_object.get(base_object.id, ([], []))
+            lines = [(line_id, {'position': 'body'}) for line_id in body_line_ids]
             # Add bottom lines if provided
-            if conf['additional_line_property']:
-                lines += [(line, {'position': 'bottom', 'read_only': True}) for line in _get_prop(base_object, conf['additional_line_property'], [])]
-            for (line, line_data) in lines:
+            lines += [(line_id, {'position': 'bottom', 'read_only': True}) for line_id in bottom_line_ids]
+            for (line_id, line_data) in lines:
+                line = lines_data[line_id]
                 # Transfer some line data to the matrix widget
                 line_data.update({
-                    'id': line.id,
-                    'name': self._get_title_or_id(line),
+                    'id': line_id,
+                    'name': labels[line_type].get(line_id, _("Untitled")),
                     })
 
                 # Get the type of the widget we'll use to display cell values
-                line_widget = _get_prop(line, conf['line_rendering_dynamic_property'], conf['default_line_rendering'])
+                line_widget = _get_record_value(line, conf['line_rendering_dynamic_property'], conf['default_line_rendering'])
 
                 # Force position of boolean widget to bottom
                 if line_widget == 'boolean':
@@ -332,7 +960,7 @@ class matrix(fields.dummy):
                 if line_read_only or conf['hide_remove_line_buttons']:
                     line_removable = False
                 else:
-                    line_removable = _get_prop(line, conf['line_removable_property'], True)
+                    line_removable = _get_record_value(line, conf['line_removable_property'], True)
 
                 line_data.update({
                     'widget': line_widget,
@@ -343,64 +971,36 @@ class matrix(fields.dummy):
                 # Get all resources of the line
                 # Keep the order defined by matrix field's properties
                 res_list = []
-                for res in conf['tree_definition']:
+                for res in tree_definition:
                     res_id = res['line_property']
-                    resource = _get_prop(line, res_id)
+                    resource_id = _get_record_value(line, res_id)
                     res_list.append({
                         'id': res_id,
-                        'label': resource.id and self._get_title_or_id(resource) or line_data['name'],
-                        'value': resource.id,
+                        'label': resource_id and labels[res['resource_type']].get(resource_id, _("Untitled")) or line_data['name'],
+                        'value': resource_id,
                         })
                 line_data.update({'resources': res_list})
 
-                # Get all cells of the line, indexed by their IDs
-                cells = dict([(cell.id, cell) for cell in _get_prop(line, conf['cell_property'], [])])
+                # Index all cells of the line by their date. Stale cells are just skipped, they are removed by matrix_vacuum().
+                cells = self._index_cells_by_date(cells_by_line.get(line_id, []), conf['cell_date_property'], visible_dates)[0]
 
                 # Provide to the matrix a cell for each visible date in the range
-                cells_data = {}
-                for d in visible_date_range:
-                    # Find a cell corresponding to the date in the date_range
-                    cell = None
-                    for (cell_id, cell) in cells.items():
-                        cell_date = datetime.datetime.strptime(_get_prop(cell, conf['cell_date_property']), '%Y-%m-%d').date()
-                        if cell_date == d:
-                            break
-                    # Get the current value and its allowed range
-                    cell_value_range = conf['cell_value_range']
-                    if isinstance(cell_value_range, (str, unicode)):
-                        cell_value_range = _get_prop(cell, conf['cell_value_range'], conf['cell_value_default_range'])
-                    cell_value = _get_prop(cell, conf['cell_value_property'], conf['cell_default_value'])
-                    # Skip the cell to hide it if its visible property is True
-                    visible_cell = _get_prop(cell, conf['cell_visible_property'], True)
-                    if not visible_cell:
-                        continue
-                    # Pop the cell ID to mark it as consumed (this will prevent it to be automatticaly removed later)
-                    if cell is not None:
-                        cells.pop(cell_id)
-                    # Set cell editability according its dynamic property.
-                    read_only_cell = _get_prop(cell, conf['cell_readonly_property'], False)
-                    if line_data.get('read_only', False):
-                        # If the line is readonly then the cell is force to readonly.
-                        read_only_cell = True
-                    elif d not in editable_date_range:
-                        # Column-level options override cells-level visibility properties
-                        read_only_cell = True
-                    # Pack all properties of the cell
-                    cells_data[d.strftime('%Y%m%d')] = {
-                        'value': cell_value,
-                        'value_range': cell_value_range,
-                        'read_only': read_only_cell,
-                        }
+                self._init_cells(line_data, len(date_range), conf['compact_format'])
+                self._fill_line_cells(conf, line_data, cells, loaded_displayed_dates, editable_dates, date_strs, date_indexes, palette)
 
-                line_data.update({'cells_data': cells_data})
-                # Remove all out of date, duplicate cells and inactive cells
-                obj.pool.get(conf['cell_type']).unlink(cr, uid, cells.keys(), context)
+                # Cells which are not loaded yet only carry their value, to let the widget keep its totals right
+                if loaded_dates is not None:
+                    all_cells = self._index_cells_by_date(all_cells_by_line.get(line_id, []), conf['cell_date_property'], visible_dates)[0]
+                    rows[line_id] = self._get_row_values(conf, all_cells, displayed_dates, date_indexes, len(date_range))
+                    line_data['unloaded_values'] = dict([(date_strs[date_indexes[d]], rows[line_id][date_indexes[d]]) for d in displayed_dates if d not in loaded_dates and rows[line_id][date_indexes[d]] is not None])
 
                 # Get data of additional columns
                 for line_property in [c['line_property'] for c in conf['additional_columns'] if 'line_property' in c]:
-                    if line_property in line_data['cells_data']:
+                    if line_property in line_data['cells_data'] or line_property in date_keys:
                         raise osv.except_osv('Error !', "Additional line property %s conflicts with matrix column ID." % line_property)
-                    v = _get_prop(line, line_property)
+                    v = _get_record_value(lines_data[line_id], line_property)
+                    if v is None:
+                        raise osv.except_osv('Error !', "%s line %r has no %s property." % (line_type, line_id, line_property))
                     if type(v) != type(0.0):
                         v = float(v)
                     line_data['cells_data'].update({line_property: {
@@ -411,41 +1011,58 @@ class matrix(fields.dummy):
                 matrix_data.append(line_data)
 
             # Get default cells and their values for the template row.
-            template_cells_data = {}
-            for d in visible_date_range:
+            template_line_data = {}
+            self._init_cells(template_line_data, len(date_range), conf['compact_format'])
+            for d in displayed_dates:
                 # Set the editability of the cell
                 read_only_cell = False
-                if d not in editable_date_range:
+                if d not in editable_dates:
                     read_only_cell = True
-                template_cells_data[self._date_to_str(d)] = {
-                    'value': conf['cell_default_value'],
-                    'value_range': conf['cell_value_default_range'],
-                    'read_only': read_only_cell,
-                    }
+                i = date_indexes[d]
+                self._set_cell(template_line_data, date_strs[i], i, conf['cell_default_value'], conf['cell_value_default_range'], read_only_cell, palette)
             template_resources = [{
                     'id': res['line_property'],
                     'label': res['line_property'].replace('_', ' ').title(),
                     'value': 0,
                     } for res in conf['tree_definition']]
             # Add a row template at the end
-            template_line_data = {
+            template_line_data.update({
                 'id': "template",
                 'name': "Row template",
                 'widget': conf['default_line_rendering'],
                 'position': 'body',
                 'read_only': False,
                 'removable': not conf['hide_remove_line_buttons'],
-                'cells_data': template_cells_data,
                 'resources':template_resources,
-                }
+                })
             matrix_data.append(template_line_data)
 
+            # Serialize read-only flags of the compact format and order value ranges by their index in the palette
+            value_range_palette = self._serialize_palette(matrix_data, palette)
+
+            # Dates of the columns which cells were loaded. None means all of them.
+            loaded_date_range = None
+            if loaded_dates is not None:
+                loaded_date_range = [self._date_to_str(d) for d in date_range if d in loaded_dates]
+
+            # Compute all totals here instead of letting the widget sum up cells at each level of the tree
+            totals = self._compute_totals(conf, matrix_data, date_strs, rows)
+            # Subtotals are carried by the nodes of the resource tree
+            resource_tree = self._build_resource_tree(resource_value_list, matrix_data, totals.pop('subtotals'))
+
             # Pack all data required to render the matrix
             matrix_def = conf
             matrix_def.update({
                 'matrix_data': matrix_data,
-                'date_range': [self._date_to_str(d) for d in date_range], # Format our date range for our matrix # XXX Keep them as date objects ?
+                'date_range': date_strs, # Format our date range for our matrix # XXX Keep them as date objects ?
                 'resource_value_list': resource_value_list,
+                'value_range_palette': value_range_palette,
+                'totals': totals,
+                'resource_tree': resource_tree,
+                'loaded_date_range': loaded_date_range,
+                # Let the widget know where to load missing columns from
+                'model': obj._name,
+                'res_id': base_object.id,
                 })
 
             matrix_list.update({base_object.id: matrix_def})
@@ -453,10 +1070,36 @@ class matrix(fields.dummy):
 
 
 
+# Structured ID of a matrix virtual field:
+#   * matrix_id: ID of the matrix field the virtual field belongs to;
+#   * type: either 'cell', 'res' or 'line';
+#   * line_id: ID of the line as a string, which may be prefixed by 'new', or 'removed' for the matrix-wide list of removed lines;
+#   * key: date of cells as YYYYMMDD, property ID of resources, None for lines;
+#   * date: date of cells as a datetime.date, None for other types.
+MatrixFieldId = namedtuple('MatrixFieldId', ['matrix_id', 'type', 'line_id', 'key', 'date'])
+
+# List reserved IDS that are used to separate the matrix ID prefix with the rest of the field ID
+RESERVED_SPLITBY_IDS = ['__cell_', '__res_', '__line_']
+_reserved_id_regexp = re.compile('__(cell|res|line)_')
+# Field ID patterns, once the matrix ID and the reserved ID are removed
+_field_id_regexps = {
+    'cell': re.compile('^(?P<line_id>[^_]+)_(?P<key>[0-9]{8})$'),
+    'res':  re.compile('^(?P<line_id>[^_]+)_(?P<key>.+)$'),
+    'line': re.compile('^(?P<line_id>[^_]+)$'),
+    }
+# Line IDs are integers, optionally prefixed by 'new' for the ones created in the matrix
+_line_id_regexp = re.compile('^(new)?(0|-?[1-9][0-9]*)$')
+
+# The same virtual fields are parsed on each read and write of a matrix
+_field_id_cache = LRUCache(size=4096)
+_ignored_field_id = object()
+
+
+
 def parse_virtual_field_id(id_string):
     """ This utility method parse and validate virtual fields coming from the matrix
         Raise an exception if it tries to read a field that doesn't follow Matrix widget conventions.
-        Return None for fields generated by the matrix but not usefull for data input.
+        Return None for fields generated by the matrix but not usefull for data input, or a MatrixFieldId otherwise.
         Valid matrix field names:
             * MATRIX_ID__res_XX_PROPERTY_ID
             * MATRIX_ID__res_newXX_PROPERTY_ID
@@ -469,59 +1112,54 @@ def parse_virtual_field_id(id_string):
             * MATRIX_ID__cell_XX_YYYYMMDD
             * MATRIX_ID__cell_newXX_YYYYMMDD
             * MATRIX_ID__cell_template_YYYYMMDD    (ignored)
-        XXX Can we increase the readability of the validation rules embedded in this method by using reg exps ?
+        Results are cached, as the same fields are parsed again on each save.
     """
-    matrix_id = None
-    # List reserved IDS that are used to separate the matrix ID prefix with the rest of the field ID
-    RESERVED_SPLITBY_IDS = ['__cell_', '__res_', '__line_']
-    # Separate the matrix ID and the field ID
-    for reserved_id in RESERVED_SPLITBY_IDS:
-        splits = id_string.split(reserved_id)
-        if len(splits) < 2:
-            continue
-        # Two instances of a reserved ID was found,
-        # or we already found a matrix ID but we can still split with another reserved ID.
-        # In either case, that's bad !
-        if len(splits) > 2 or matrix_id is not None:
-            raise osv.except_osv('Error !', "Field %r is composed of more than one of the reserved strings %r." % (id_string, RESERVED_SPLITBY_IDS))
-        matrix_id = splits[0]
-    if not matrix_id:
+    field_id = _field_id_cache.get(id_string)
+    if field_id is None:
+        field_id = _parse_virtual_field_id(id_string)
+        _field_id_cache.set(id_string, field_id)
+    if field_id is _ignored_field_id:
+        return None
+    return field_id
+
+
+
+def _parse_virtual_field_id(id_string):
+    """ Uncached version of parse_virtual_field_id(), returning _ignored_field_id for ignored fields
+    """
+    # Separate the matrix ID and the field ID: a field must have one and only one reserved ID
+    reserved_ids = _reserved_id_regexp.findall(id_string)
+    if len(reserved_ids) > 1:
+        raise osv.except_osv('Error !', "Field %r is composed of more than one of the reserved strings %r." % (id_string, RESERVED_SPLITBY_IDS))
+    match = _reserved_id_regexp.search(id_string)
+    if not match or not match.start():
         raise osv.except_osv('Error !', "Field %r has no matrix ID as a prefix." % id_string)
-    f_id = id_string[len(matrix_id) + 2:]
-    f_id_elements = f_id.split('_')
+    matrix_id = id_string[:match.start()]
+    field_type = match.group(1)
 
-    # Check fields element lenght depending on their type
-    if (f_id_elements[0] == 'cell' and len(f_id_elements) == 3) or \
-       (f_id_elements[0] == 'res'  and len(f_id_elements) >= 3) or \
-       (f_id_elements[0] == 'line' and len(f_id_elements) == 2):
+    match = _field_id_regexps[field_type].match(id_string[match.end():])
+    if match:
+        line_id = match.group('line_id')
+        key = None
+        if field_type != 'line':
+            key = match.group('key')
 
         # Silently ignore some fields that are only used for interactivity by the matrix javascript
-        if f_id.startswith('cell_template_') or \
-           f_id.startswith('res_template_')  or \
-           f_id.startswith('res_dummy')      or \
-           f_id.startswith('res_list_'):
-            return None
-
-        # For ressource, the last parameter is the property ID of the line the resource belong to. Recompose it
-        if f_id_elements[0] == 'res':
-            f_id_elements = f_id_elements[:2] + ['_'.join(f_id_elements[2:])]
-            # TODO: check that the PROPERTY_ID (aka f_id_elements[2]) exist as a column in the line data model
+        if line_id == 'template' or \
+           (field_type == 'res' and (line_id.startswith('dummy') or line_id == 'list')):
+            return _ignored_field_id
 
         # Check that the date is valid
-        if f_id_elements[0] == 'cell':
-            date_element = f_id_elements[2]
+        cell_date = None
+        if field_type == 'cell':
             try:
-                datetime.datetime.strptime(date_element, '%Y%m%d').date()
+                cell_date = datetime.datetime.strptime(key, '%Y%m%d').date()
             except ValueError:
-                raise osv.except_osv('Error !', "Field %r don't have a valid %r date element." % (id_string, date_element))
+                raise osv.except_osv('Error !', "Field %r don't have a valid %r date element." % (id_string, key))
 
-        # Check that the second element is an integer. It is allowed to starts with the 'new' prefix.
-        id_element = f_id_elements[1]
-        if id_element.startswith('new'):
-            id_element = id_element[3:]
-        if (f_id_elements[0] == 'line' and id_element == 'removed') or \
-           str(int(id_element)) == id_element:
-            return [matrix_id] + f_id_elements
+        # Check that the line ID is an integer. It is allowed to starts with the 'new' prefix.
+        if (field_type == 'line' and line_id == 'removed') or _line_id_regexp.match(line_id):
+            return MatrixFieldId(matrix_id, field_type, line_id, key, cell_date)
 
     # Requested field doesn't follow matrix convention
     raise osv.except_osv('Error !', "Field %r doesn't respect matrix widget conventions." % id_string)
@@ -530,18 +1168,105 @@ def parse_virtual_field_id(id_string):
 
 def _get_matrix_fields(osv_instance):
     """ Utility method to get all matrix fields defined on the class the provided object is an instance of.
+        They are looked up once and kept on the instance, which is replaced by a new one each time the registry of the database is reloaded.
     """
-    field_defs = osv_instance.__dict__['_columns']
-    # The existence of a matrix_conf property indicate that the field is a matrix
-    matrix_fields = dict([(f_id, f) for (f_id, f) in field_defs.items() if f.__dict__.get('matrix_conf', False)])
-    if not len(matrix_fields):
-        return None
-    return matrix_fields
+    if '_matrix_fields' not in osv_instance.__dict__:
+        field_defs = osv_instance.__dict__['_columns']
+        # The existence of a matrix_conf property indicate that the field is a matrix
+        matrix_fields = dict([(f_id, f) for (f_id, f) in field_defs.items() if f.__dict__.get('matrix_conf', False)])
+        osv_instance._matrix_fields = matrix_fields or None
+        osv_instance._matrix_fields_conf = dict([(matrix_id, matrix.matrix_conf) for (matrix_id, matrix) in matrix_fields.items()])
+    return osv_instance._matrix_fields
 
 
 
 def _get_matrix_fields_conf(obj):
-    return dict([(matrix_id, matrix.matrix_conf) for (matrix_id, matrix) in _get_matrix_fields(obj).items()])
+    _get_matrix_fields(obj)
+    return obj._matrix_fields_conf
+
+
+
+def _get_resource_stamp_name(model):
+    """ Return the name of the stamp incremented each time a resource of the model changes
+    """
+    return 'matrix.resource,%s' % model
+
+
+
+def matrix_resource_patch(func):
+    """
+    Let the matrix cache the lists of resources new lines can be linked to.
+    Decorate the create(), write() and unlink() methods of a model used as a resource_type in a tree_definition to invalidate them each time a resource changes.
+    """
+
+    @wraps(func)
+    def invalidate_resource_values(obj, cr, *arg, **kw):
+        result = func(obj, cr, *arg, **kw)
+        touch_stamps(cr, [_get_resource_stamp_name(obj._name)])
+        return result
+
+    invalidate_resource_values.matrix_resource_patch = True
+    return invalidate_resource_values
+
+
+
+def matrix_vacuum(obj, cr, uid, ids=None, context=None, chunk_size=200):
+    """ Remove stale cells of all matrix fields defined on the provided object.
+        This garbage collection is kept out of the read path and is intended to be called in batch by a scheduled action.
+        If no IDs are provided, all objects of the model are processed.
+        A cell is only removed if none of the matrix sharing it displays it.
+        Return a dict of removed cell IDs indexed by cell type.
+    """
+    matrix_fields = _get_matrix_fields(obj)
+    if not matrix_fields:
+        return {}
+    if ids is None:
+        ids = obj.search(cr, uid, [], context=context)
+    elif isinstance(ids, (int, long)):
+        ids = [ids]
+    removed_cells = {}
+    for chunk_start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[chunk_start:chunk_start + chunk_size]
+        # Group kept and stale cells by cell type, as several matrix can share the same cells
+        kept_cells = {}
+        stale_cells = {}
+        for matrix_field in matrix_fields.values():
+            cell_type = matrix_field.matrix_conf['cell_type']
+            (kept_cell_ids, stale_cell_ids) = matrix_field._get_stale_cells(obj, cr, uid, chunk_ids, context)
+            kept_cells.setdefault(cell_type, set()).update(kept_cell_ids)
+            stale_cells.setdefault(cell_type, set()).update(stale_cell_ids)
+        # Remove all stale cells of a type at once
+        for (cell_type, stale_cell_ids) in stale_cells.items():
+            cell_ids = list(stale_cell_ids.difference(kept_cells[cell_type]))
+            if not cell_ids:
+                continue
+            obj.pool.get(cell_type).unlink(cr, uid, cell_ids, context)
+            removed_cells.setdefault(cell_type, []).extend(cell_ids)
+    for (cell_type, cell_ids) in removed_cells.items():
+        _logger.info("Matrix vacuum removed %d stale %s cells from %d %s objects." % (len(cell_ids), cell_type, len(ids), obj._name))
+    return removed_cells
+
+
+
+def matrix_remove_duplicate_cells(cell_obj, cr, inverse_property, date_property):
+    """ Remove cells sharing the same line and date, to let a unique constraint on them be added to databases holding such duplicates.
+        Intended to be called by _auto_init() of cell models before the constraint is installed. The cell the matrix displays is kept, i.e. the first active one.
+        Return the number of removed cells.
+    """
+    cr.execute("SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'r'", (cell_obj._table, ))
+    if not cr.fetchone():
+        return 0
+    order = 'id'
+    if 'active' in cell_obj._columns:
+        cr.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'active'", (cell_obj._table, ))
+        if cr.fetchone():
+            order = 'active DESC, id'
+    cr.execute("""DELETE FROM "%s" WHERE id IN (
+        SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY "%s", "%s" ORDER BY %s) AS position FROM "%s") AS cells
+        WHERE position > 1)""" % (cell_obj._table, inverse_property, date_property, order, cell_obj._table))
+    if cr.rowcount:
+        _logger.warning("Removed %d duplicate %s cells." % (cr.rowcount, cell_obj._name))
+    return cr.rowcount
 
 
 
@@ -561,33 +1286,58 @@ def matrix_read_patch(func):
         context = kw.get('context', None)
         if isinstance(ids, (int, long)):
             result = [result]
-        updated_result = []
-        for props in result:
-            unread_fields = set(fields).difference(set(props.keys()))
+        # Virtual fields don't depend on the object: resolve them once for all rows
+        virtual_values = {}
+        if result:
+            unread_fields = set(fields).difference(set(result[0].keys()))
             for (matrix_id, conf) in _get_matrix_fields_conf(obj).items():
-                cell_pool = obj.pool.get(conf['cell_type'])
-                line_pool = obj.pool.get(conf['line_type'])
+                # Group requested fields by line, then by date for cells and by property for resources
+                cell_fields = {}
+                res_fields = {}
                 for f_id in unread_fields:
-                    parsed_elements = parse_virtual_field_id(f_id)
-                    if parsed_elements and parsed_elements[0] == matrix_id:
-                        f_id_elements = parsed_elements[1:]
-                        field_value = None
+                    field_id = parse_virtual_field_id(f_id)
+                    if field_id and field_id.matrix_id == matrix_id:
+                        virtual_values[f_id] = None
                         # Don't try to fetch current value of newly created cells and other write-only matrix-wide fields
-                        WRITE_ONLY_FIELDS = [['line', 'removed']]
-                        if f_id_elements not in WRITE_ONLY_FIELDS and not f_id_elements[1].startswith('new'):
-                            line_id = int(f_id_elements[1])
-                            if f_id_elements[0] == 'cell':
-                                cell_date = datetime.datetime.strptime(f_id_elements[2], '%Y%m%d').date()
-                                cell_id = cell_pool.search(cr, uid, [(conf['cell_date_property'], '=', cell_date.strftime('%Y-%m-%d')), (conf['cell_inverse_property'], '=', line_id)], limit=1, context=context)
-                                if cell_id:
-                                    cell = cell_pool.browse(cr, uid, cell_id, context)[0]
-                                    field_value = getattr(cell, conf['cell_value_property'])
-                            elif f_id_elements[0] == 'res':
-                                if line_id:
-                                    resource_property = f_id_elements[2]
-                                    line = line_pool.browse(cr, uid, line_id, context)
-                                    field_value = getattr(line, resource_property).id
-                        props.update({f_id: field_value})
+                        if field_id.line_id == 'removed' or field_id.line_id.startswith('new'):
+                            continue
+                        line_id = int(field_id.line_id)
+                        if field_id.type == 'cell':
+                            cell_date = field_id.date.strftime('%Y-%m-%d')
+                            cell_fields.setdefault(line_id, {}).setdefault(cell_date, []).append(f_id)
+                        elif field_id.type == 'res' and line_id:
+                            res_fields.setdefault(line_id, {}).setdefault(field_id.key, []).append(f_id)
+                # Fetch all requested cells with a single query
+                if cell_fields:
+                    cell_pool = obj.pool.get(conf['cell_type'])
+                    cell_dates = set()
+                    for dates in cell_fields.values():
+                        cell_dates.update(dates.keys())
+                    cell_ids = cell_pool.search(cr, uid, [(conf['cell_inverse_property'], 'in', cell_fields.keys()), (conf['cell_date_property'], 'in', list(cell_dates))], context=context)
+                    cells = cell_pool.read(cr, uid, cell_ids, [conf['cell_inverse_property'], conf['cell_date_property'], conf['cell_value_property']], context, load='_classic_write')
+                    # Like a search limited to one result, only keep the first cell found for a line and a date
+                    cells_by_id = dict([(c['id'], c) for c in cells])
+                    found_cells = set()
+                    for cell in [cells_by_id[cell_id] for cell_id in cell_ids if cell_id in cells_by_id]:
+                        cell_key = (cell[conf['cell_inverse_property']], cell[conf['cell_date_property']])
+                        if cell_key in found_cells:
+                            continue
+                        found_cells.add(cell_key)
+                        for f_id in cell_fields.get(cell_key[0], {}).get(cell_key[1], []):
+                            virtual_values[f_id] = cell[conf['cell_value_property']]
+                # Fetch resources of all requested lines at once
+                if res_fields:
+                    res_properties = set()
+                    for properties in res_fields.values():
+                        res_properties.update(properties.keys())
+                    lines = obj.pool.get(conf['line_type']).read(cr, uid, res_fields.keys(), list(res_properties), context, load='_classic_write')
+                    for line in lines:
+                        for (resource_property, f_ids) in res_fields[line['id']].items():
+                            for f_id in f_ids:
+                                virtual_values[f_id] = line[resource_property]
+        updated_result = []
+        for props in result:
+            props.update(virtual_values)
             updated_result.append(props)
         if isinstance(ids, (int, long)):
             updated_result = updated_result[0]
@@ -596,7 +1346,209 @@ def matrix_read_patch(func):
 
 
 
-def matrix_write_patch(parse_only=False):
+def matrix_create_lines(obj, cr, uid, conf, new_lines, context=None):
+    """ Create new lines of a matrix from a list of (line values, submitted cells) tuples.
+        Submitted cells are passed to the create() method of lines through their one2many field, so lines can skip the default cells they already get.
+        With the direct_sql_write option, lines are all inserted with a single query instead, their create() method and default cells being bypassed.
+        Return a list of (line ID, cells left to save) tuples, in the same order as new lines.
+    """
+    line_pool = obj.pool.get(conf['line_type'])
+    lines_data = []
+    for (line_data, cells) in new_lines:
+        line_data = dict([(k, v) for (k, v) in line_data.items() if k != 'id'])
+        cells = [dict([(k, v) for (k, v) in cell_data.items() if k != conf['cell_inverse_property']]) for cell_data in cells]
+        lines_data.append((line_data, cells))
+    if conf['direct_sql_write']:
+        line_ids = _sql_create_lines(line_pool, cr, uid, [line_data for (line_data, cells) in lines_data], context)
+        return [(line_id, cells) for (line_id, (line_data, cells)) in zip(line_ids, lines_data)]
+    new_line_ids = []
+    for (line_data, cells) in lines_data:
+        line_data[conf['cell_property']] = [(0, 0, cell_data) for cell_data in cells]
+        new_line_ids.append((line_pool.create(cr, uid, line_data, context), []))
+    return new_line_ids
+
+
+
+def _is_value_changed(stored_value, new_value, precision):
+    """ Compare a value submitted by the matrix to the stored one, as rendered by the widget at the given precision.
+        The submitted value is compared exactly, so a change smaller than the precision is still saved.
+    """
+    try:
+        return round(float(stored_value), precision) != float(new_value)
+    except (TypeError, ValueError):
+        return stored_value != new_value
+
+
+
+def _write_matrix_cells(obj, cr, uid, conf, cells_by_line, visible_date_range, precision, context=None):
+    """ Save the cells submitted by a matrix, provided as lists of cell values indexed by line ID.
+        All existing cells of the lines are loaded at once to sort submitted cells in those to create, update or remove.
+        Cells are removed if they are not visible anymore, and left untouched if their value didn't change at the given precision.
+        Inactive cells are not displayed by the matrix: they are reactivated with the submitted value, or left archived if their date is not visible.
+    """
+    if not cells_by_line:
+        return
+    cell_pool = obj.pool.get(conf['cell_type'])
+    visible_dates = _get_date_set(visible_date_range)
+    # Index existing cells by line and date. Like a search limited to one result, only keep the first cell found.
+    cell_fields = [conf['cell_inverse_property'], conf['cell_date_property'], conf['cell_value_property']]
+    if _has_field(cell_pool, conf['cell_visible_property']):
+        cell_fields.append(conf['cell_visible_property'])
+    if _has_field(cell_pool, 'active'):
+        cell_fields.append('active')
+    # Inactive cells are looked up too, as they still hold their line and date
+    cell_ids = cell_pool.search(cr, uid, [(conf['cell_inverse_property'], 'in', cells_by_line.keys())], context=dict(context or {}, active_test=False))
+    cells_by_id = dict([(c['id'], c) for c in cell_pool.read(cr, uid, cell_ids, cell_fields, context, load='_classic_write')])
+    existing_cells = {}
+    for cell in [cells_by_id[cell_id] for cell_id in cell_ids if cell_id in cells_by_id]:
+        existing_cells.setdefault((cell[conf['cell_inverse_property']], cell[conf['cell_date_property']]), cell)
+    # Sort submitted cells
+    cells_to_create = []
+    cell_ids_to_remove = []
+    cell_ids_to_reactivate = []
+    cell_ids_by_value = {}
+    for (line_id, cells) in cells_by_line.items():
+        for cell_data in cells:
+            cell_data.update({conf['cell_inverse_property']: line_id})
+            cell_date = cell_data[conf['cell_date_property']]
+            cell = existing_cells.get((line_id, cell_date.strftime('%Y-%m-%d')), None)
+            # Cell doesn't exists, create it
+            if cell is None:
+                cells_to_create.append(cell_data)
+            # Inactive cells are not displayed, so the matrix submitted a new cell in place of it: reuse the inactive one
+            elif not cell.get('active', True):
+                if cell_date in visible_dates:
+                    cell_ids_to_reactivate.append(cell['id'])
+                    cell_ids_by_value.setdefault(cell_data[conf['cell_value_property']], []).append(cell['id'])
+            # Update cell with our data or delete it if it's not visible
+            elif cell_date not in visible_dates or not _get_record_value(cell, conf['cell_visible_property'], True):
+                cell_ids_to_remove.append(cell['id'])
+            # The widget posts all cells: don't write those the user didn't change
+            elif not _is_value_changed(cell[conf['cell_value_property']], cell_data[conf['cell_value_property']], precision):
+                continue
+            else:
+                cell_ids_by_value.setdefault(cell_data[conf['cell_value_property']], []).append(cell['id'])
+    # Apply changes: cells sharing the same new value are updated together
+    if cell_ids_to_remove:
+        cell_pool.unlink(cr, uid, cell_ids_to_remove, context)
+    if conf['direct_sql_write']:
+        _sql_write_cells(cell_pool, cr, uid, conf, cell_ids_by_value, cells_to_create, cell_ids_to_reactivate, context)
+        return
+    if cell_ids_to_reactivate:
+        cell_pool.write(cr, uid, cell_ids_to_reactivate, {'active': True}, context)
+    for (cell_value, cell_ids) in cell_ids_by_value.items():
+        cell_pool.write(cr, uid, cell_ids, {conf['cell_value_property']: cell_value}, context)
+    for cell_data in cells_to_create:
+        cell_pool.create(cr, uid, cell_data, context)
+
+
+
+def _sql_write_cells(cell_pool, cr, uid, conf, cell_ids_by_value, cells_to_create, reactivated_ids=None, context=None):
+    """ Update and create cells with set-based SQL queries, bypassing the ORM. Cells of reactivated_ids are updated with their active flag set.
+        Access rights and record rules are still enforced, constraints are checked once for all saved cells, and stored function fields depending on cells are recomputed.
+    """
+    value_column = cell_pool._columns.get(conf['cell_value_property'], None)
+    if value_column is None or isinstance(value_column, fields.function) or value_column._type != 'float':
+        raise osv.except_osv('Error !', "direct_sql_write requires %s to be a stored float column of %s." % (conf['cell_value_property'], conf['cell_type']))
+    access_pool = cell_pool.pool.get('ir.model.access')
+    log_access = cell_pool._log_access
+
+    # Update all cells sharing the same value with a single query
+    updated_ids = []
+    reactivated_ids = reactivated_ids or []
+    if cell_ids_by_value:
+        access_pool.check(cr, uid, cell_pool._name, 'write', context=context)
+        for (cell_value, cell_ids) in cell_ids_by_value.items():
+            cell_pool.check_access_rule(cr, uid, cell_ids, 'write', context=context)
+            query = 'UPDATE "%s" SET "%s" = %%s' % (cell_pool._table, conf['cell_value_property'])
+            params = [cell_value]
+            if log_access:
+                query += ', write_uid = %s, write_date = now()'
+                params.append(uid)
+            cr.execute(query + ' WHERE id IN %s', params + [tuple(cell_ids)])
+            updated_ids.extend(cell_ids)
+        # Reactivated cells are all part of the updated ones
+        if reactivated_ids:
+            cr.execute('UPDATE "%s" SET active = true WHERE id IN %%s' % cell_pool._table, (tuple(reactivated_ids), ))
+
+    # Insert all new cells at once
+    (created_ids, column_names) = _sql_insert(cell_pool, cr, uid, cells_to_create, context)
+
+    # Check constraints of all saved cells at once
+    if updated_ids or created_ids:
+        cell_pool._validate(cr, uid, updated_ids + created_ids, context)
+
+    # Recompute stored function fields, like write() and create() do
+    store_todo = []
+    if updated_ids:
+        store_todo += cell_pool._store_get_values(cr, uid, updated_ids, [conf['cell_value_property']] + (reactivated_ids and ['active'] or []), context) or []
+    if created_ids:
+        store_todo += cell_pool._store_get_values(cr, uid, created_ids, column_names, context) or []
+    _sql_store_set_values(cell_pool, cr, uid, store_todo, context)
+
+
+
+def _sql_create_lines(line_pool, cr, uid, lines_data, context=None):
+    """ Create lines with a single SQL query, bypassing the ORM and so the create() method of lines.
+        Like _sql_write_cells(), access rights, record rules and constraints are still enforced, and stored function fields are recomputed.
+        Return the IDs of new lines, in the same order as their data.
+    """
+    (created_ids, column_names) = _sql_insert(line_pool, cr, uid, lines_data, context)
+    if created_ids:
+        line_pool._validate(cr, uid, created_ids, context)
+        _sql_store_set_values(line_pool, cr, uid, line_pool._store_get_values(cr, uid, created_ids, column_names, context) or [], context)
+    return created_ids
+
+
+
+def _sql_insert(model_pool, cr, uid, vals_list, context=None):
+    """ Insert records with a single multi-row SQL query, completed with default values of other plain columns.
+        Records are all expected to provide the same fields. Access rights and record rules are checked.
+        Return the IDs of new records, in the same order as their values, and the list of columns set.
+    """
+    if not vals_list:
+        return ([], [])
+    model_pool.pool.get('ir.model.access').check(cr, uid, model_pool._name, 'create', context=context)
+    log_access = model_pool._log_access
+    plain_columns = [c_id for (c_id, c) in model_pool._columns.items() if c._classic_write and not isinstance(c, fields.function) and c._type not in ['one2many', 'many2many']]
+    defaults = model_pool.default_get(cr, uid, plain_columns, context)
+    column_names = sorted(set(defaults.keys()).union(vals_list[0].keys()).intersection(plain_columns))
+    # Reserve IDs first, as rows returned by an INSERT are not guaranteed to keep the order of its values
+    cr.execute("SELECT nextval('%s') FROM generate_series(1, %%s)" % model_pool._sequence, (len(vals_list), ))
+    created_ids = [row[0] for row in cr.fetchall()]
+    params = []
+    for (record_id, vals) in zip(created_ids, vals_list):
+        record_vals = defaults.copy()
+        record_vals.update(vals)
+        params += [record_id] + [record_vals.get(c_id, None) for c_id in column_names]
+        if log_access:
+            params += [uid, uid]
+    query_columns = ['id'] + column_names
+    query_values = ['%s'] * len(query_columns)
+    if log_access:
+        query_columns += ['create_uid', 'write_uid', 'create_date', 'write_date']
+        query_values += ['%s', '%s', 'now()', 'now()']
+    row_values = '(%s)' % ', '.join(query_values)
+    cr.execute('INSERT INTO "%s" (%s) VALUES %s' % (model_pool._table, ', '.join(['"%s"' % c for c in query_columns]), ', '.join([row_values] * len(vals_list))), params)
+    model_pool.check_access_rule(cr, uid, created_ids, 'create', context=context)
+    return (created_ids, column_names)
+
+
+
+def _sql_store_set_values(model_pool, cr, uid, store_todo, context=None):
+    """ Recompute stored function fields as returned by _store_get_values(), like write() and create() do
+    """
+    store_todo.sort()
+    done = set()
+    for (priority, model_name, ids, fields_to_compute) in store_todo:
+        ids = [i for i in ids if (model_name, tuple(fields_to_compute), i) not in done]
+        done.update([(model_name, tuple(fields_to_compute), i) for i in ids])
+        if ids:
+            model_pool.pool.get(model_name)._store_set_values(cr, uid, ids, fields_to_compute, context)
+
+
+
+def matrix_write_patch(parse_only=False, dense_output=False):
     """
         Method intended to use as a decorator on the default write() defined on
         objects having a matrix field.
@@ -609,6 +1561,12 @@ def matrix_write_patch(parse_only=False):
         dictionnary containing all editable matrix values and their new values, thus
         giving you the oportunity to write matrix content with your own strategy.
         This is generally useful to enhance performance.
+
+        With the dense_output option, parse_only provides cells of each line as
+        a dense row instead of a list of cell dicts: a dict with a 'values'
+        array of floats and a 'mask' array of bytes set to 1 for submitted
+        cells. Rows of a matrix are aligned on its sorted list of dates, stored
+        under the '_date_axis' key.
     """
 
     def write_decorator(func):
@@ -619,95 +1577,112 @@ def matrix_write_patch(parse_only=False):
             (obj, cr, uid, ids, vals) = arg[:5]
             context = kw.get('context', None)
 
-            # We plan to update the original vals variable
-            cleaned_vals = deepcopy(vals)
-
             # Fix common OpenERP inconsistency
             if isinstance(ids, (int, long)):
                 ids = [ids]
 
+            # Sort all virtual matrix fields in a single pass, by matrix then by line. Other fields are left to the original method.
+            matrix_confs = _get_matrix_fields_conf(obj)
+            cleaned_vals = {}
+            removed_lines = dict([(matrix_id, []) for matrix_id in matrix_confs])
+            matrix_lines = dict([(matrix_id, {}) for matrix_id in matrix_confs])
+            for (f_id, f_value) in vals.items():
+                matrix_id = f_id.split('__', 1)[0]
+                # Ignore non-matrix fields
+                if matrix_id not in matrix_confs or matrix_id == f_id:
+                    cleaned_vals[f_id] = f_value
+                    continue
+
+                # Parsing field ID will discard non-editable ones
+                field_id = parse_virtual_field_id(f_id)
+                if not field_id or field_id.matrix_id != matrix_id:
+                    continue
+
+                # Catch removed lines field
+                if field_id.type == 'line' and field_id.line_id == 'removed':
+                    for line_field_id in [parse_virtual_field_id(l_id.strip()) for l_id in f_value.split(',') if l_id.strip()]:
+                        if line_field_id.matrix_id == matrix_id and line_field_id.type == 'line' and not line_field_id.line_id.startswith('new'):
+                            removed_lines[matrix_id].append(int(line_field_id.line_id))
+
+                # We're reading a __cell_ or a __res_ type of field: regroup them to the line they belongs to
+                elif field_id.type in ['res', 'cell']:
+                    line_data = matrix_lines[matrix_id].setdefault(field_id.line_id, {'res': {}, 'cell': {}})
+                    if field_id.type == 'res':
+                        line_data['res'][field_id.key] = int(f_value)
+                    else:
+                        # Transform the value to a float, if the user has entered nothing just use the default value
+                        cell_value = ''.join([c for c in f_value if c.isdigit() or c in ['-', '.', ',']]).replace(',', '.')
+                        try:
+                            cell_value = float(cell_value)
+                        except ValueError:
+                            cell_value = matrix_confs[matrix_id]['cell_default_value']
+                        line_data['cell'][field_id.date] = cell_value
+
+            # Check all required resources are provided by the matrix
+            for (matrix_id, lines) in matrix_lines.items():
+                required_res_ids = set([prop['line_property'] for prop in matrix_confs[matrix_id]['tree_definition']])
+                for (line_id, line_data) in lines.items():
+                    res_ids = set(line_data['res'].keys())
+                    if res_ids != required_res_ids:
+                        raise osv.except_osv('Error !', "Line %s resource mismatch: %r provided while we're expecting %r." % (line_id, res_ids, required_res_ids))
+
+            # Align dense rows of each matrix on the sorted list of all submitted dates
+            date_axes = {}
+            if parse_only and dense_output:
+                for (matrix_id, lines) in matrix_lines.items():
+                    matrix_dates = set()
+                    for line_data in lines.values():
+                        matrix_dates.update(line_data['cell'].keys())
+                    date_axes[matrix_id] = sorted(matrix_dates)
+
             for report in obj.browse(cr, uid, ids, context):
 
                 # Write one matrix at a time
-                for (matrix_id, conf) in _get_matrix_fields_conf(obj).items():
+                for (matrix_id, conf) in matrix_confs.items():
 
                     removed_line_property_id = '_deleted_%s' % conf['line_property']
                     matrix_data = {
-                        removed_line_property_id: [],
+                        removed_line_property_id: list(removed_lines[matrix_id]),
                         }
 
-                    lines = {}
-                    for (f_id, f_value) in vals.items():
-
-                        # Ignore non-matrix fields
-                        if not f_id.startswith('%s__' % matrix_id):
-                            continue
-                        # Remove consumed virtual matrix field
-                        elif f_id in cleaned_vals:
-                            del cleaned_vals[f_id]
-
-                        # Parsing field ID will discard non-editable ones
-                        parsed_elements = parse_virtual_field_id(f_id)
-                        if parsed_elements and parsed_elements[0] == matrix_id:
-                            f_id_elements = parsed_elements[1:]
-
-                            # Catch removed lines field
-                            if f_id_elements == ['line', 'removed']:
-                                for line_id_elements in [parse_virtual_field_id(l_id.strip()) for l_id in f_value.split(',') if l_id.strip()]:
-                                    if line_id_elements[0] == matrix_id and line_id_elements[1] == 'line' and not line_id_elements[2].startswith('new'):
-                                        matrix_data[removed_line_property_id].append(int(line_id_elements[2]))
-
-                            # We're reading a __cell_ or a __res_ type of field: regroup them to the line they belongs to
-                            elif f_id_elements[0] in ['res', 'cell']:
-                                line_id = f_id_elements[1]
-                                line_data = lines.get(line_id, {})
-                                line_data.update({f_id: f_value})
-                                lines[line_id] = line_data
+                    lines = matrix_lines[matrix_id]
 
                     # No matrix data was edited on that matrix, so skip updating it
                     if not lines and not matrix_data[removed_line_property_id]:
                         continue
 
-                    # Parse data of each line
+                    if matrix_id in date_axes:
+                        date_axis = date_axes[matrix_id]
+                        date_indexes = dict([(d, i) for (i, d) in enumerate(date_axis)])
+                        matrix_data['_date_axis'] = list(date_axis)
+
+                    # Pack data of each line in a comprehensive structure
                     for (line_id, line_data) in lines.items():
-                        # Get line resources
-                        line_resources = dict([(parse_virtual_field_id(f_id)[3], int(v)) for (f_id, v) in line_data.items() if f_id.startswith('%s__res_' % matrix_id)])
-                        # Check all required resources are provided by the matrix
-                        res_ids = set(line_resources.keys())
-                        required_res_ids = set([prop['line_property'] for prop in conf['tree_definition']])
-                        if res_ids != required_res_ids:
-                            raise osv.except_osv('Error !', "Line %s resource mismatch: %r provided while we're expecting %r." % (line_id, res_ids, required_res_ids))
-                        # Get line cells
-                        line_cells = dict([(datetime.datetime.strptime(parse_virtual_field_id(f_id)[3], '%Y%m%d').date(), v) for (f_id, v) in line_data.items() if f_id.startswith('%s__cell_' % matrix_id)])
-                        #
                         if line_id.startswith('new'):
                             line_id = None
                         else:
                             line_id = int(line_id)
-
-                        # Parse and clean-up cells data
-                        clean_cells = []
-                        for (cell_date, cell_value) in line_cells.items():
-                            # Transform the value to a float, if the user has entered nothing just use the default value
-                            cell_value = ''.join([c for c in cell_value if c.isdigit() or c in ['-', '.', ',']]).replace(',', '.')
-                            try:
-                                cell_value = float(cell_value)
-                            except ValueError:
-                                cell_value = conf['cell_default_value']
-                            clean_cells.append({
+                        if matrix_id in date_axes:
+                            clean_cells = {
+                                'values': array('d', [0.0]) * len(date_axis),
+                                'mask': array('B', [0]) * len(date_axis),
+                                }
+                            for (cell_date, cell_value) in line_data['cell'].items():
+                                clean_cells['values'][date_indexes[cell_date]] = float(cell_value)
+                                clean_cells['mask'][date_indexes[cell_date]] = 1
+                        else:
+                            clean_cells = [{
                                 conf['cell_value_property']: cell_value,
                                 conf['cell_date_property']: cell_date,
                                 conf['cell_inverse_property']: line_id,
-                                })
-
-                        # Pack all cleaned matrix data in a comprehensive structure
-                        line_properties = deepcopy(line_resources)
+                                } for (cell_date, cell_value) in line_data['cell'].items()]
+                        line_properties = dict(line_data['res'])
                         line_properties.update({
                             'id': line_id,
                             conf['cell_property']: clean_cells,
                             conf['line_inverse_property']: report.id,
                             })
-                        matrix_data[conf['line_property']] = matrix_data.get(conf['line_property'], []) + [line_properties]
+                        matrix_data.setdefault(conf['line_property'], []).append(line_properties)
 
                     if parse_only:
                         # Inject a clean version of matrix data in the vals
@@ -719,38 +1694,26 @@ def matrix_write_patch(parse_only=False):
 
                     # Get our date ranges
                     (date_range, visible_date_range, editable_date_range) = _get_date_range(report, conf['date_range_property'], conf['visible_date_range_property'], conf['editable_date_range_property'])
+                    # The precision is a dynamic property, which may have to be evaluated on the object
+                    precision = conf['precision']
+                    if isinstance(precision, (str, unicode)):
+                        precision = int(_get_prop(report, precision, 2))
 
                     # Write all our aggregated matrix data
+                    cells_by_line = {}
+                    new_lines = []
                     for line_data in matrix_data.get(conf['line_property'], {}):
                         cells = line_data.pop(conf['cell_property'])
                         # Line has no idea so was created in the matrix
-                        line_id = line_data.get('id', None)
-                        if not line_id:
-                            line_id = obj.pool.get(conf['line_type']).create(cr, uid, line_data, context)
-
-                        # Save cells data
-                        for cell_data in cells:
-                            cell_data.update({'line_id': line_id})
-                            cell_date = cell_data[conf['cell_date_property']]
-                            # Search for an existing cell at the given date
-                            cell_pool = obj.pool.get(conf['cell_type'])
-                            cell_ids = cell_pool.search(cr, uid, [(conf['cell_date_property'], '=', cell_date.strftime('%Y-%m-%d')), (conf['cell_inverse_property'], '=', line_id)], context=context, limit=1)
-                            # Cell doesn't exists, create it
-                            if not cell_ids:
-                                cell_pool.create(cr, uid, cell_data, context)
-                            # Update or delete the cell
-                            else:
-                                cell_id = cell_ids[0]
-                                # Compute the visibility state of the cell
-                                cell = cell_pool.browse(cr, uid, cell_id, context)
-                                visible_cell = _get_prop(cell, conf['cell_visible_property'], True)
-                                if cell_date not in visible_date_range:
-                                    visible_cell = False
-                                # Update cell with our data or delete it if it's not visible
-                                if not visible_cell:
-                                    cell_pool.unlink(cr, uid, cell_id, context)
-                                else:
-                                    cell_pool.write(cr, uid, cell_id, cell_data, context)
+                        if not line_data.get('id', None):
+                            new_lines.append((line_data, cells))
+                        else:
+                            cells_by_line[line_data['id']] = cells
+                    # Create new lines at once, cells they don't save themselves are saved with the ones of other lines
+                    for (line_id, cells) in matrix_create_lines(obj, cr, uid, conf, new_lines, context):
+                        if cells:
+                            cells_by_line[line_id] = cells
+                    _write_matrix_cells(obj, cr, uid, conf, cells_by_line, visible_date_range, precision, context)
 
                     if matrix_data[removed_line_property_id]:
                         report.pool.get(conf['line_type']).unlink(cr, uid, matrix_data[removed_line_property_id], context)
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2011-2012 Smile. All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from osv import osv, fields
+
+
+
+class smile_matrix_stamp(osv.osv):
+    """ Counters stamping the data matrix caches are computed from.
+        A counter is incremented in the same transaction as the changes it stamps, so the value a transaction reads is consistent with the data it sees.
+    """
+
+    _name = 'smile.matrix.stamp'
+
+    _log_access = False
+
+    _columns = {
+        'name': fields.char('Name', size=128, required=True, select=True),
+        'generation': fields.integer('Generation', required=True),
+        }
+
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', "Stamp names must be unique."),
+        ]
+
+smile_matrix_stamp()
+
+
+
+def _get_touched_stamps(cr):
+    """ Return the set of stamp names the cursor incremented, which are not committed yet
+    """
+    touched = getattr(cr, '_matrix_touched_stamps', None)
+    if touched is None:
+        touched = set()
+        cr._matrix_touched_stamps = touched
+    return touched
+
+
+
+def touch_stamps(cr, names):
+    """ Increment the stamps of the given names, creating them on first use.
+    """
+    names = list(set(names))
+    if not names:
+        return
+    cr.execute("UPDATE smile_matrix_stamp SET generation = generation + 1 WHERE name IN %s RETURNING name", (tuple(names), ))
+    updated_names = set([row[0] for row in cr.fetchall()])
+    for name in names:
+        if name not in updated_names:
+            cr.execute("INSERT INTO smile_matrix_stamp (name, generation) VALUES (%s, 1)", (name, ))
+    _get_touched_stamps(cr).update(names)
+
+
+
+def get_stamps(cr, names):
+    """ Return the committed generation of each of the given stamps, indexed by name.
+        Stamps the cursor incremented itself are not committed yet: they are returned as None, and nothing should be cached against them.
+    """
+    names = list(set(names))
+    if not names:
+        return {}
+    cr.execute("SELECT name, generation FROM smile_matrix_stamp WHERE name IN %s", (tuple(names), ))
+    generations = dict(cr.fetchall())
+    touched = _get_touched_stamps(cr)
+    stamps = {}
+    for name in names:
+        stamps[name] = None
+        if name not in touched:
+            stamps[name] = generations.get(name, 0)
+    return stamps
@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2011-2012 Smile. All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.controllers import SecuredController
+from openerp.utils import rpc
+from openobject.tools import expose
+
+
+
+class MatrixController(SecuredController):
+
+    _cp_path = "/smile_matrix_widget/matrix"
+
+    @expose('json')
+    def columns(self, model, res_id, field, first_date, last_date, **kw):
+        """ Return the cells of all lines of a matrix for the given window of dates.
+            This is called by the widget to load columns on demand as the navigation slider moves.
+            The matrix_window context key makes the field only read the cells of the window, skipping resources, labels and totals.
+            Cells are sent in the compact format: values aligned on the returned dates, a string of read-only flags and value ranges indexes in a palette.
+        """
+        context = dict(rpc.session.context, matrix_window={field: (first_date, last_date)})
+        matrix_def = rpc.RPCProxy(model).read([int(res_id)], [field], context)[0][field]
+        dates = matrix_def.get('loaded_date_range') or []
+        date_indexes = dict([(d, i) for (i, d) in enumerate(matrix_def.get('date_range', []))])
+        palette = matrix_def.get('value_range_palette') or []
+        palette_indexes = dict([(repr(r), i) for (i, r) in enumerate(palette)])
+        lines = []
+        for line in matrix_def.get('matrix_data', []):
+            # Template line is always fully rendered
+            if line['id'] == 'template':
+                continue
+            line_window = {
+                'id': line['id'],
+                'widget': line.get('widget', 'float'),
+                'values': [],
+                'read_only_mask': '',
+                'value_ranges': [],
+                }
+            for d in dates:
+                if 'values' in line:
+                    i = date_indexes[d]
+                    (cell_value, read_only, range_index) = (line['values'][i], line['read_only_mask'][i], line['value_ranges'][i])
+                else:
+                    cell = line.get('cells_data', {}).get(d, {})
+                    (cell_value, read_only, range_index) = (cell.get('value'), cell.get('read_only') and '1' or '0', None)
+                    # Intern value ranges of matrices sent in the default format
+                    if cell.get('value_range') is not None:
+                        range_key = repr(cell['value_range'])
+                        if range_key not in palette_indexes:
+                            palette_indexes[range_key] = len(palette)
+                            palette.append(cell['value_range'])
+                        range_index = palette_indexes[range_key]
+                line_window['values'].append(cell_value)
+                line_window['read_only_mask'] += read_only
+                line_window['value_ranges'].append(range_index)
+            lines.append(line_window)
+        return dict(dates=dates, lines=lines, value_range_palette=palette)
@@ -47,8 +47,11 @@ jQuery(document).ready(function($){
         default_value = isNaN(default_value) ? 0.0 : default_value;
         var raw_value;
         var cell = $(cell);
+        // Placeholder of a cell not loaded yet, which only carries its value
+        if (cell.is("td.unloaded")) {
+            raw_value = cell.attr("data-value");
         // Editable widget containing the cell value was directly provided
-        if (cell.is("input, select")) {
+        } else if (cell.is("input, select")) {
             raw_value = cell.attr('value');
         // We got an editable cell containing a widget with the value
         } else if (cell.find("input, select").length > 0) {
@@ -97,7 +100,7 @@ jQuery(document).ready(function($){
 
 
     // Cycles buttons
-    buttons.click(function(){
+    function cycle_button_value(){
         var button_value_tag = $(this).parent().find("input");
         var button_label_tag = $(this);
         var cycling_values = get_increment_values($(button_value_tag));
@@ -110,7 +113,8 @@ jQuery(document).ready(function($){
         button_label_tag.text(new_value);
         button_value_tag.val(new_value);
         button_value_tag.trigger('change');
-    });
+    };
+    buttons.click(cycle_button_value);
 
 
     // Render a float to a given precision
@@ -164,7 +168,7 @@ jQuery(document).ready(function($){
         // Select all fields of the columns and sum them up
         var column_total = 0;
         // Only cells in the tbody of the table are sums up by columns
-        $("#" + matrix_id + " tbody tr:not(.resource_line) [id^='" + matrix_id + "__cell_'][id$='_" + column_index + "']").each(function(){
+        $("#" + matrix_id + " tbody tr:not(.resource_line)").find("[id^='" + matrix_id + "__cell_'][id$='_" + column_index + "'], [id^='" + matrix_id + "__unloaded_'][id$='_" + column_index + "']").each(function(){
             column_total += get_cell_value($(this));
         });
         // Get warning threshold
@@ -221,7 +225,7 @@ jQuery(document).ready(function($){
     function update_row_total(matrix_id, row_index){
         // Select all fields of the row and sum them up
         var row_total = 0;
-        $("#" + matrix_id + " table [id^='" + matrix_id + "__cell_" + row_index + "_']").each(function(i, cell){
+        $("#" + matrix_id + " table").find("[id^='" + matrix_id + "__cell_" + row_index + "_'], [id^='" + matrix_id + "__unloaded_" + row_index + "_']").each(function(i, cell){
             row_total += get_cell_value(cell);
         });
         $("#" + matrix_id + "__row_total_" + row_index).text(render_float(matrix_id, row_total)).each(function(i, cell){
@@ -244,7 +248,7 @@ jQuery(document).ready(function($){
 
 
     // Compute columns and row totals
-    $(".matrix [id*='__cell_']").change(function(){
+    function update_cell_totals(){
         // Get current cell coordinates
         var cell_id = $(this).attr("id");
         var name_fragments = parse_id(cell_id);
@@ -260,7 +264,8 @@ jQuery(document).ready(function($){
             update_parent_subtotal(matrix_id, cell_id);
             update_grand_total(matrix_id);
         };
-    });
+    };
+    $(".matrix [id*='__cell_']").change(update_cell_totals);
 
 
     // Utility method to get the level we're currently at
@@ -563,6 +568,162 @@ jQuery(document).ready(function($){
         // Show and hide appropriate columns
         $(columns_to_show.join(", ")).filter(":hidden").fadeIn('fast');
         $(columns_to_hide.join(", ")).filter(":visible").hide();
+
+        // Fetch cells of columns we're getting close to
+        load_columns(matrix_id, new_position);
+    };
+
+
+    // Load from the server the cells of the columns around the navigation slider which were not rendered with the matrix
+    function load_columns(matrix_id, position){
+        var res_id = $("#" + matrix_id + "__res_id").first().val();
+        // Columns of that matrix are all loaded at once
+        if (!res_id) {
+            return;
+        };
+        var navigation_size = parseInt($("#" + matrix_id + "__navigation_size").first().val());
+        var navigation_margin = parseInt($("#" + matrix_id + "__navigation_margin").first().val());
+        var columns_to_load = new Array();
+        $("#" + matrix_id + " th[id*='__column_label_']").each(function(i, cell){
+            var $cell = $(cell);
+            var cell_position = i + 1;
+            if ($cell.hasClass("unloaded") && cell_position >= position - navigation_margin && cell_position < position + navigation_size + navigation_margin) {
+                columns_to_load.push(parse_id($cell.attr("id"))[3]);
+                // Flag the column to not request it twice
+                $cell.removeClass("unloaded").addClass("loading");
+            };
+        });
+        if (!columns_to_load.length) {
+            return;
+        };
+        $.ajax({
+            url: "/smile_matrix_widget/matrix/columns",
+            type: "POST",
+            dataType: "json",
+            data: {
+                model: $("#" + matrix_id + "__model").first().val(),
+                res_id: res_id,
+                field: matrix_id,
+                first_date: columns_to_load[0],
+                last_date: columns_to_load[columns_to_load.length - 1],
+                },
+            success: function(data){
+                fill_columns(matrix_id, data);
+            },
+            error: function(){
+                // Let the next move try again
+                $.each(columns_to_load, function(i, column_index){
+                    $("#" + matrix_id + "__column_label_" + column_index).removeClass("loading").addClass("unloaded");
+                });
+            },
+            });
+    };
+
+
+    // Replace the placeholder of a cell by its value, the same way the template renders it
+    function render_loaded_cell(matrix_id, placeholder, cell_id, cell_def, widget){
+        var cell_value = cell_def ? cell_def.value : null;
+        // Only editable matrix have a field to keep track of removed lines
+        var cell_editable = $("#" + matrix_id + "__line_removed").length > 0 && !(cell_def && cell_def.read_only);
+        placeholder.removeAttr("id").removeAttr("data-value").removeClass("unloaded");
+        if (!cell_editable || cell_value === null || cell_value === undefined) {
+            placeholder.attr("id", cell_id);
+        };
+        if (cell_value === null || cell_value === undefined) {
+            return;
+        };
+        if (!cell_editable) {
+            if (widget == "boolean") {
+                var checkbox = $('<input type="checkbox" kind="boolean" class="checkbox" readonly="readonly" disabled="disabled"/>');
+                checkbox.attr("name", cell_id).attr("id", cell_id).val(cell_value ? "1" : "0").attr("checked", cell_value ? true : false);
+                placeholder.removeAttr("id").append(checkbox);
+            } else {
+                placeholder.text(render_float(matrix_id, cell_value));
+            };
+            if (!cell_value) {
+                placeholder.addClass("zero");
+            } else if (cell_value < 0) {
+                placeholder.addClass("negative");
+            };
+            return;
+        };
+        if (widget == "boolean") {
+            var field = $('<input type="hidden" kind="boolean"/>').val(cell_value ? "1" : "0");
+            var checkbox = $('<input type="checkbox" enabled="enabled" kind="boolean" class="checkbox"/>').attr("id", cell_id + "_checkbox_").attr("checked", cell_value ? true : false);
+            placeholder.append(field).append(checkbox);
+        } else if (widget == "selection") {
+            var field = $('<select kind="float"/>').addClass(widget);
+            $.each(cell_def.value_range || [], function(i, v){
+                var option = $("<option/>").val(v).text(v);
+                if (parseFloat(v) == parseFloat(cell_value)) {
+                    option.attr("selected", "selected");
+                };
+                field.append(option);
+            });
+            placeholder.append(field);
+        } else {
+            var field = $('<input type="text" kind="float" size="1"/>').addClass(widget).val(render_float(matrix_id, cell_value));
+            placeholder.append(field);
+            if (widget == "increment") {
+                var button = $(".matrix .button.increment.template").first().clone().removeClass("template").removeAttr("id").text(field.val());
+                button.click(cycle_button_value);
+                field.hide().after(button);
+            };
+        };
+        field.attr("name", cell_id).attr("id", cell_id).change(update_cell_totals);
+    };
+
+
+    // Decode the cell found at the given position of a line sent in the compact format
+    function get_compact_cell(line, position, value_range_palette){
+        var cell_value = line.values[position];
+        if (cell_value === null || cell_value === undefined) {
+            return null;
+        };
+        var range_index = line.value_ranges[position];
+        return {
+            "value": cell_value,
+            "read_only": line.read_only_mask.charAt(position) == "1",
+            "value_range": range_index === null ? [] : value_range_palette[range_index],
+            };
+    };
+
+
+    // Render cells of freshly loaded columns and update all totals depending on them
+    function fill_columns(matrix_id, data){
+        // Only keep columns still waiting for their cells
+        var loaded_positions = new Array();
+        $.each(data.dates, function(j, date){
+            if ($("#" + matrix_id + "__column_label_" + date).hasClass("loading")) {
+                loaded_positions.push(j);
+            };
+        });
+        var loaded_dates = $.map(loaded_positions, function(j){
+            return data.dates[j];
+        });
+        var cell_ids = new Array();
+        $.each(data.lines, function(i, line){
+            $.each(loaded_positions, function(k, j){
+                var date = data.dates[j];
+                var placeholder = $("#" + matrix_id + "__unloaded_" + line.id + "_" + date);
+                if (!placeholder.length) {
+                    return;
+                };
+                var cell_id = matrix_id + "__cell_" + line.id + "_" + date;
+                render_loaded_cell(matrix_id, placeholder, cell_id, get_compact_cell(line, j, data.value_range_palette), line.widget);
+                cell_ids.push(cell_id);
+            });
+            update_row_total(matrix_id, line.id);
+        });
+        $.each(loaded_dates, function(i, date){
+            $("#" + matrix_id + "__column_label_" + date).removeClass("loading");
+            update_column_total(matrix_id, date);
+        });
+        $.each(cell_ids, function(i, cell_id){
+            update_parent_subtotal(matrix_id, cell_id);
+        });
+        update_grand_total(matrix_id);
+        update_partial_totals(matrix_id);
     };
 
 
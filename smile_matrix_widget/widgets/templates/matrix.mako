@@ -29,14 +29,21 @@
 </%def>
 
 
-<%def name="noiseless_sum(l)">
+<%def name="get_cell(line, date)">
 <%
-    # Special sum method which return None if the list we want to sum is empty or composed of None values only
-    filtered_list = [v for v in l if v is not None]
-    if not len(filtered_list):
+    # Get the cell of a line at the given date, whatever the format the matrix was sent in
+    if 'values' not in line:
+        return line.get('cells_data', {}).get(date, None)
+    i = date_indexes[date]
+    cell_value = line['values'][i]
+    if cell_value is None:
         return None
-    else:
-        return sum(filtered_list)
+    range_index = line['value_ranges'][i]
+    return {
+        'value': cell_value,
+        'value_range': range_index is not None and value_range_palette[range_index] or [],
+        'read_only': line['read_only_mask'][i] == '1',
+        }
 %>
 </%def>
 
@@ -189,12 +196,26 @@
             %endif
 
             %for date in date_range:
-                <%
-                    cell_id = '%s__cell_%s_%s' % (name, line['id'], date)
-                    cell_def = line.get('cells_data', {}).get(date, None)
-                    cell_css = [print_now(date)]
-                %>
-                ${render_cell(cell_def, cell_id, date, line_widget, css_classes=cell_css)}
+                %if loaded_dates is not None and date not in loaded_dates and line['id'] != 'template':
+                    <%doc>
+                        Placeholder of a cell which will be loaded on demand by the navigation. It carries the value of the cell to keep totals right.
+                    </%doc>
+                    <%
+                        unloaded_value = line.get('unloaded_values', {}).get(date)
+                    %>
+                    <td id="${'%s__unloaded_%s_%s' % (name, line['id'], date)}" class="column_${date} ${print_now(date)} unloaded"
+                        %if unloaded_value is not None:
+                            data-value="${unloaded_value}"
+                        %endif
+                        ></td>
+                %else:
+                    <%
+                        cell_id = '%s__cell_%s_%s' % (name, line['id'], date)
+                        cell_def = get_cell(line, date)
+                        cell_css = [print_now(date)]
+                    %>
+                    ${render_cell(cell_def, cell_id, date, line_widget, css_classes=cell_css)}
+                %endif
             %endfor
 
             %if navigation:
@@ -203,7 +224,7 @@
 
             %if not hide_line_totals:
                 <%
-                    row_total = noiseless_sum([v['value'] for (k, v) in line.get('cells_data', dict()).items() if k in date_range])
+                    row_total = totals['row_totals'].get(str(line['id']), None)
                     row_total_cell_id = not read_only and "%s__row_total_%s" % (name, line['id']) or None
                     row_total_cell = {
                         'value': row_total,
@@ -241,8 +262,9 @@
 </%def>
 
 
-<%def name="render_sub_matrix_header(level_res, res_values, level, date_range, sub_lines=[], css_class=None, show_selector=True)">
+<%def name="render_sub_matrix_header(level_res, res_values, level, date_range, subtotal={}, css_class=None, show_selector=True)">
     <%
+        subtotal_values = subtotal.get('values', [None] * len(date_range))
         # Build a virtual line to freeze resources at that level
         virtual_line = {
             'id': 'dummy%s' % value['row_uid'],
@@ -262,7 +284,7 @@
 
         ${render_resources(virtual_line)}
 
-        ${render_additional_column_subtotals(value['additional_columns'], sub_lines, position='left')}
+        ${render_additional_column_subtotals(value['additional_columns'], subtotal, position='left')}
 
         %if show_selector and len(res_values.get('values', [])) and editable_mode and res_values.get('editable', True):
             <%
@@ -286,7 +308,7 @@
             %for date in date_range:
                 <%
                     date_column_sum_cell = {
-                        'value': noiseless_sum([line.get('cells_data', dict()).get(date, {}).get('value') for line in sub_lines]),
+                        'value': subtotal_values[date_indexes[date]],
                         'read_only': True,
                         }
                     cell_id = '%s__cell_%s_%s' % (name, virtual_line['id'], date)
@@ -303,11 +325,8 @@
 
         %if not hide_line_totals:
             <%
-                row_total = []
-                for line in sub_lines:
-                    row_total += [v['value'] for (k, v) in line.get('cells_data', dict()).items() if k in date_range]
                 row_total_cell = {
-                    'value': noiseless_sum(row_total),
+                    'value': subtotal.get('total', None),
                     'read_only': True,
                     }
                 row_total_cell_id = "%s__row_total_%s" % (name, virtual_line['id'])
@@ -315,45 +334,25 @@
             ${render_cell(row_total_cell, cell_id=row_total_cell_id, css_classes=['total'])}
         %endif
 
-        ${render_additional_column_subtotals(value['additional_columns'], sub_lines, position='right')}
+        ${render_additional_column_subtotals(value['additional_columns'], subtotal, position='right')}
 
     </tr>
 </%def>
 
 
-<%def name="render_sub_matrix(lines, resource_value_list, date_range, level=1, level_resources=[], editable_tree=True, hide_tree=False)">
-    %if level < len(resource_value_list):
-        <%
-            res_def = resource_value_list[level - 1]
-            res_id = res_def.get('id', None)
-            res_values = res_def.get('values', [])
-        %>
-        %for (res_value, res_label) in res_values:
-            <%
-                level_res = level_resources + [{
-                    'id': res_id,
-                    'label': res_label,
-                    'value': res_value,
-                    }]
-                sub_lines = []
-                for line in lines:
-                    matching_resources = [r for r in line.get('resources', dict()) if r['id'] == res_id and r['value'] == res_value]
-                    if len(matching_resources):
-                        sub_lines.append(line)
-            %>
-            %if len(sub_lines):
-                %if not hide_tree:
-                    ${render_sub_matrix_header(level_res, resource_value_list[level], level, date_range, sub_lines, show_selector=editable_tree)}
-                %endif
-                ${render_sub_matrix(sub_lines, resource_value_list, date_range, level + 1, level_res, editable_tree=editable_tree, hide_tree=hide_tree)}
-            %endif
-        %endfor
-    %endif
-    %if level == len(resource_value_list):
-        %for line in lines:
-            ${render_line(line, date_range, level)}
-        %endfor
-    %endif
+<%def name="render_sub_matrix(node, resource_value_list, date_range, level=1, editable_tree=True, hide_tree=False)">
+    <%doc>
+        Walk the resource tree prebuilt by the matrix field: a header for each node, then its sub-nodes or its lines.
+    </%doc>
+    %for sub_node in node['children']:
+        %if not hide_tree:
+            ${render_sub_matrix_header(sub_node['resources'], resource_value_list[level], level, date_range, sub_node['totals'], show_selector=editable_tree)}
+        %endif
+        ${render_sub_matrix(sub_node, resource_value_list, date_range, level + 1, editable_tree=editable_tree, hide_tree=hide_tree)}
+    %endfor
+    %for line_index in node['line_indexes']:
+        ${render_line(lines[line_index], date_range, level)}
+    %endfor
 </%def>
 
 
@@ -364,7 +363,7 @@
 </%def>
 
 
-<%def name="render_additional_column_subtotals(columns, sub_lines, position='right')">
+<%def name="render_additional_column_subtotals(columns, subtotal, position='right')">
     %for col_def in [c for c in [col for col in columns if col.get('position', 'right') == position] if 'line_property' in c]:
         <%
             additional_sum_cell = {
@@ -372,18 +371,18 @@
                 'read_only': True,
             }
             if not col_def.get('hide_tree_totals', False):
-                additional_sum_cell.update({'value': noiseless_sum([line.get('cells_data', dict()).get(col_def['line_property'], {}).get('value') for line in sub_lines])})
+                additional_sum_cell.update({'value': subtotal.get('additional', {}).get(col_def['line_property'], None)})
         %>
         ${render_cell(additional_sum_cell, css_classes=['additional_column'])}
     %endfor
 </%def>
 
 
-<%def name="render_additional_column_totals(columns, body_lines, position='right')">
+<%def name="render_additional_column_totals(columns, position='right')">
     %for line_property in [c['line_property'] for c in [col for col in columns if col.get('position', 'right') == position] if 'line_property' in c]:
         <%
             additional_sum_cell = {
-                'value': noiseless_sum([line.get('cells_data', dict()).get(line_property, {}).get('value') for line in body_lines]),
+                'value': totals['additional_totals'].get(line_property, None),
                 'read_only': True,
                 }
         %>
@@ -416,11 +415,15 @@
             lines = value.get('matrix_data', [])
             top_lines    = [l for l in lines if l.get('position', 'body') == 'top']
             bottom_lines = [l for l in lines if l.get('position', 'body') == 'bottom']
-            body_lines   = [l for l in lines if l.get('position', 'body') not in ['top', 'bottom']]
 
             resource_value_list = value['resource_value_list']
             increment_values = value['increment_values']
             date_range = value['date_range']
+            # Cells sent in the compact format are indexed by their position in the date range
+            date_indexes = dict([(d, i) for (i, d) in enumerate(date_range)])
+            value_range_palette = value.get('value_range_palette', None)
+            # Totals and subtotals are all computed by the matrix field
+            totals = value['totals']
             date_format = value['date_format']
             hide_line_title = value['hide_line_title']
             hide_column_totals = value['hide_column_totals']
@@ -433,6 +436,14 @@
             navigation_start = value['navigation_start']
             highlight_date = value['highlight_date']
             precision = value['precision']
+
+            # Only a window of columns is loaded with the matrix, the others are fetched by the navigation
+            loaded_dates = value.get('loaded_date_range', None)
+            if loaded_dates is not None:
+                loaded_dates = set(loaded_dates)
+            navigation_margin = value.get('navigation_margin', None)
+            if navigation_margin is None:
+                navigation_margin = navigation_size
         %>
 
         <style type="text/css">
@@ -527,6 +538,11 @@
                 background-color: #ddd;
             }
 
+            .matrix .unloaded,
+            .matrix .loading {
+                background-color: #eee;
+            }
+
             .matrix td.warning {
                 background: #f00;
                 color: #fff;
@@ -689,6 +705,11 @@
                     <span class="button navigation end" title="End">&rsaquo;&rsaquo;</span>
                     <input type="hidden" id="${"%s__navigation_size" % name}" value="${navigation_size}" title="Date range navigation width"/>
                     <input type="hidden" id="${"%s__navigation_start" % name}" value="${navigation_start}" title="Position from which we start the date range navigation"/>
+                    %if loaded_dates is not None:
+                        <input type="hidden" id="${"%s__model" % name}" value="${value['model']}" title="Model of the object holding the matrix"/>
+                        <input type="hidden" id="${"%s__res_id" % name}" value="${value['res_id']}" title="ID of the object holding the matrix"/>
+                        <input type="hidden" id="${"%s__navigation_margin" % name}" value="${navigation_margin}" title="Number of columns to load around the navigation window"/>
+                    %endif
                 </div>
             %endif
         </div>
@@ -705,7 +726,11 @@
                         <th id="${"%s__previous_cell" % name}" class="left navigation"><span class="button navigation previous" title="Previous">&lsaquo;</span></th>
                     %endif
                     %for date in date_range:
-                        <th id="${"%s__column_label_%s" % (name, date)}" class="column_${date} ${print_now(date)}">${dt.strptime(date, '%Y%m%d').strftime(str(date_format))}</th>
+                        <th id="${"%s__column_label_%s" % (name, date)}" class="column_${date} ${print_now(date)}
+                            %if loaded_dates is not None and date not in loaded_dates:
+                                unloaded
+                            %endif
+                            ">${dt.strptime(date, '%Y%m%d').strftime(str(date_format))}</th>
                     %endfor
                     %if navigation:
                         <th id="${"%s__next_cell" % name}" class="right navigation"><span class="button navigation next" title="Next">&rsaquo;</span></th>
@@ -723,7 +748,7 @@
                             <td class="delete_column"></td>
                         %endif
                         <td class="resource">${value['total_label']}</td>
-                        ${render_additional_column_totals(value['additional_columns'], body_lines, position='left')}
+                        ${render_additional_column_totals(value['additional_columns'], position='left')}
                         %if navigation:
                             <td id="${"%s__navigation_lefttotal_total" % (name)}" class="left navigation"></td>
                         %endif
@@ -735,12 +760,10 @@
                                     }
                                 column_total_cell_id = "%s__column_total_%s" % (name, date)
                                 column_total_css_classes.append(print_now(date))
-                                column_values = [line['cells_data'][date]['value'] for line in body_lines if (date in line.get('cells_data', dict())) and (line['widget'] not in ['header', 'spacer'])]
-                                if len(column_values):
-                                    column_total = noiseless_sum(column_values)
-                                    if column_totals_warning_threshold is not None and column_total > column_totals_warning_threshold:
-                                        column_total_css_classes.append('warning')
-                                    column_total_cell.update({'value': column_total})
+                                date_index = date_indexes[date]
+                                if totals['column_warnings'][date_index]:
+                                    column_total_css_classes.append('warning')
+                                column_total_cell.update({'value': totals['column_totals'][date_index]})
                             %>
                             ${render_cell(column_total_cell, cell_id=column_total_cell_id, col_id=date, css_classes=column_total_css_classes)}
                         %endfor
@@ -750,14 +773,14 @@
                         %if not hide_line_totals:
                             <%
                                 grand_total_cell = {
-                                    'value': noiseless_sum([noiseless_sum([v['value'] for (k, v) in line['cells_data'].items() if k in date_range]) for line in body_lines if line['widget'] not in ['header', 'spacer'] ]),
+                                    'value': totals['grand_total'],
                                     'read_only': True,
                                     }
                                 grand_total_cell_id = "%s__grand_total" % name
                             %>
                             ${render_cell(grand_total_cell, cell_id=grand_total_cell_id)}
                         %endif
-                        ${render_additional_column_totals(value['additional_columns'], body_lines, position='right')}
+                        ${render_additional_column_totals(value['additional_columns'], position='right')}
                     </tr>
                 %endif
                 %for line in bottom_lines:
@@ -767,9 +790,8 @@
             <tbody>
                 <%
                     template_line = [l for l in lines if l['id'] == 'template'][0]
-                    non_templates_lines = [l for l in body_lines if l['id'] != 'template']
                 %>
-                ${render_sub_matrix(non_templates_lines, resource_value_list, date_range, editable_tree=editable_tree, hide_tree=hide_tree)}
+                ${render_sub_matrix(value['resource_tree'], resource_value_list, date_range, editable_tree=editable_tree, hide_tree=hide_tree)}
 
                 %if editable_tree:
                     <%doc>